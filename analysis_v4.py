@@ -0,0 +1,171 @@
+from element import Element
+from intbase import InterpreterBase
+
+# Static analyses over Brewin v4 ASTs.
+#
+# Brewin v4 is dynamically scoped: a function body can read and write any
+# variable that lives in one of its callers' frames.  The analyses here work out,
+# per function body, which names that code could touch outside of its own frame.
+
+BUILTIN_FUNCS = {"print", "inputi"}
+
+
+# yields the Element children of an AST node, in source order
+def children(node):
+    for value in node.dict.values():
+        if isinstance(value, Element):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, Element):
+                    yield item
+
+
+# yields every node of a function body, without descending into nested lambdas
+def body_nodes(func_ast):
+    stack = list(reversed(func_ast.get("statements")))
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.elem_type != InterpreterBase.LAMBDA_DEF:
+            stack.extend(reversed(list(children(node))))
+
+
+# yields every lambda node of the program, including nested ones
+def all_lambdas(program_ast):
+    stack = list(program_ast.get("functions"))
+    while stack:
+        node = stack.pop()
+        if node.elem_type == InterpreterBase.LAMBDA_DEF:
+            yield node
+        stack.extend(children(node))
+
+
+def param_names(func_ast):
+    return {arg.get("name") for arg in func_ast.get("args")}
+
+
+# the variable part of a (possibly dotted) name, e.g. "a" for "a.b"
+def base_name(name):
+    return name.split(".")[0]
+
+
+class FunctionSummary:
+    def __init__(self, func_ast, func_table):
+        self.names = set()  # variable names read or written by the body
+        self.static_calls = []  # top-level functions called by name
+        self.lambdas = []  # lambdas created by the body
+        self.dynamic_calls = False  # calls through variables
+        self.method_calls = False  # calls through objects
+
+        for node in body_nodes(func_ast):
+            kind = node.elem_type
+            if kind == InterpreterBase.VAR_DEF:
+                self.names.add(base_name(node.get("name")))
+            elif kind == "=":
+                self.names.add(base_name(node.get("name")))
+            elif kind == InterpreterBase.FCALL_DEF:
+                name = node.get("name")
+                if name in BUILTIN_FUNCS:
+                    continue
+                if name in func_table:
+                    target = func_table[name].get(len(node.get("args")))
+                    if target is not None:
+                        self.static_calls.append(target)
+                else:
+                    self.names.add(name)
+                    self.dynamic_calls = True
+            elif kind == InterpreterBase.MCALL_DEF:
+                self.names.add(node.get("objref"))
+                self.method_calls = True
+            elif kind == InterpreterBase.LAMBDA_DEF:
+                self.lambdas.append(node)
+
+
+# Answers "which names outside its own frame could running this function touch?"
+# A call made in a function's frame can see every variable in that frame, so a
+# frame may only be discarded early when the answer is disjoint from its names.
+class CallGraph:
+    def __init__(self, program_ast):
+        self.program_ast = program_ast
+        self.func_table = {}
+        for func_def in program_ast.get("functions"):
+            arities = self.func_table.setdefault(func_def.get("name"), {})
+            arities[len(func_def.get("args"))] = func_def
+        self.summaries = {}
+        self.free_cache = {}
+        self.dynamic_targets = None
+
+    def summary(self, func_ast):
+        key = id(func_ast)
+        if key not in self.summaries:
+            self.summaries[key] = FunctionSummary(func_ast, self.func_table)
+        return self.summaries[key]
+
+    # names of the top-level functions that are used as values somewhere
+    def referenced_functions(self):
+        referenced = set()
+        stack = list(self.program_ast.get("functions"))
+        while stack:
+            node = stack.pop()
+            if node.elem_type == InterpreterBase.VAR_DEF:
+                name = base_name(node.get("name"))
+                if name in self.func_table:
+                    referenced.add(name)
+            stack.extend(children(node))
+        return referenced
+
+    # every body that can be called through a variable or an object member:
+    # all lambdas, plus the top-level functions that are used as values
+    def __get_dynamic_targets(self):
+        if self.dynamic_targets is None:
+            targets = list(all_lambdas(self.program_ast))
+            for name in self.referenced_functions():
+                targets.extend(self.func_table[name].values())
+            self.dynamic_targets = targets
+        return self.dynamic_targets
+
+    # names that the code func_ast calls (or may call through variables and
+    # objects) could look up in func_ast's frame
+    def callee_names(self, func_ast):
+        summary = self.summary(func_ast)
+        callees = list(summary.static_calls)
+        if summary.dynamic_calls or summary.method_calls:
+            callees.extend(self.__get_dynamic_targets())
+        names = set()
+        for callee in callees:
+            names |= self.free_names(callee)
+        return names
+
+    # names that executing func_ast (and everything it may call or capture) could
+    # look up in the frames below its own; as_method means `this` is bound locally
+    def free_names(self, func_ast, as_method=False):
+        key = (id(func_ast), as_method)
+        if key in self.free_cache:
+            return self.free_cache[key]
+
+        free = set()
+        seen = set()
+        worklist = [(func_ast, as_method)]
+        while worklist:
+            body, method = worklist.pop()
+            if (id(body), method) in seen:
+                continue
+            seen.add((id(body), method))
+            summary = self.summary(body)
+            local = summary.names - param_names(body)
+            if method:
+                local.discard(InterpreterBase.THIS_DEF)
+            free |= local
+            for callee in summary.static_calls:
+                worklist.append((callee, False))
+            for lam in summary.lambdas:
+                worklist.append((lam, False))
+            if summary.dynamic_calls:
+                worklist.extend((t, False) for t in self.__get_dynamic_targets())
+            if summary.method_calls:
+                worklist.extend((t, True) for t in self.__get_dynamic_targets())
+
+        result = frozenset(free)
+        self.free_cache[key] = result
+        return result
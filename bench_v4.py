@@ -0,0 +1,353 @@
+# Micro-benchmarks for the v4 interpreter.
+#
+# usage: python bench_v4.py [benchmark ...]
+#        python bench_v4.py memory
+# Runs each Brewin program under a couple of interpreter configurations and
+# prints the best wall-clock time of a few runs, along with how many scopes the
+# last run made and how many of those were reused from env_v4's pool.  The
+# memory benchmark allocates MEMORY_COUNT Values and objects and prints the
+# bytes each takes, next to the same data in the layout they had before
+# __slots__.
+
+import sys
+import time
+import tracemalloc
+
+from interpreterv4 import Interpreter
+from type_valuev4 import Object, Type, Value
+
+ARITH_LOOP = """
+func main() {
+  i = 0;
+  s = 0;
+  while (i < 20000) {
+    s = s + i * 3 - (i / 2);
+    if (s > 1000000) { s = s - 1000000; }
+    i = i + 1;
+  }
+  print(s);
+}
+"""
+
+COMPARE_LOOP = """
+func main() {
+  i = 0;
+  c = 0;
+  name = "abc";
+  while (i < 20000) {
+    if (i != 7 && name == "abc") { c = c + 1; }
+    if (!(i <= 3)) { c = c - -1; }
+    i = i + 1;
+  }
+  print(c);
+}
+"""
+
+REDUCTION_LOOP = """
+func main() {
+  i = 0;
+  n = 20000;
+  total = 0;
+  squares = 0;
+  line = "";
+  while (i < n) {
+    total = total + i;
+    squares = squares + i * i - n;
+    line = line + "-";
+    i = i + 1;
+  }
+  print(total, " ", squares);
+}
+"""
+
+INVARIANT_LOOP = """
+func main() {
+  i = 0;
+  n = 7;
+  s = 0;
+  while (i < 20000) {
+    if (i * 3 > n * n - 2 * n) { s = s + (n * 4 + n / 2) * i; }
+    i = i + 1;
+  }
+  print(s);
+}
+"""
+
+HELPER_CALLS = """
+func add(a, b) { return a + b; }
+func square(x) { return x * x; }
+func main() {
+  i = 0;
+  s = 0;
+  while (i < 5000) {
+    s = add(s, square(i));
+    i = i + 1;
+  }
+  print(s);
+}
+"""
+
+FIB = """
+func fib(n) {
+  if (n < 2) { return n; }
+  return fib(n - 1) + fib(n - 2);
+}
+func main() { print(fib(18)); }
+"""
+
+CLOSURES = """
+func make(k) {
+  o = @;
+  o.a = k;
+  o.b = "member";
+  base = k * 2;
+  label = "closure";
+  return lambda(x) { return x + base; };
+}
+func use(k) {
+  f = make(k);
+  return f(k);
+}
+func main() {
+  i = 0;
+  s = 0;
+  while (i < 2000) {
+    s = s + use(i);
+    i = i + 1;
+  }
+  print(s);
+}
+"""
+
+OBJECT_PASSING = """
+func build(n) {
+  o = @;
+  o.size = n;
+  node = nil;
+  i = 0;
+  while (i < n) {
+    next = @;
+    next.val = i;
+    next.rest = node;
+    node = next;
+    i = i + 1;
+  }
+  o.list = node;
+  return o;
+}
+func pass(o, depth) {
+  if (depth == 0) { return o; }
+  return pass(o, depth - 1);
+}
+func main() {
+  o = build(200);
+  i = 0;
+  s = 0;
+  while (i < 300) {
+    p = pass(o, 3);
+    s = s + p.size;
+    i = i + 1;
+  }
+  print(s);
+}
+"""
+
+LOCAL_OBJECTS = """
+func norm(a, b) {
+  p = @;
+  p.x = a;
+  p.y = b;
+  return p.x * p.x + p.y * p.y;
+}
+func make(k) {
+  o = @;
+  o.k = k;
+  o.v = k + 1;
+  return o;
+}
+func main() {
+  i = 0;
+  s = 0;
+  while (i < 3000) {
+    s = s + norm(i, 3);
+    m = make(i);
+    s = s + m.v;
+    i = i + 1;
+  }
+  print(s);
+}
+"""
+
+PROTO_METHODS = """
+func main() {
+  base = @;
+  base.scale = 2;
+  base.get = lambda(v) { return v * this.scale; };
+  mid = @;
+  mid.proto = base;
+  mid.name = "mid";
+  leaf = @;
+  leaf.proto = mid;
+  leaf.bias = 1;
+  o = @;
+  o.proto = leaf;
+  i = 0;
+  s = 0;
+  while (i < 5000) {
+    s = s + o.get(i) + o.bias + o.scale;
+    i = i + 1;
+  }
+  print(s);
+}
+"""
+
+STRING_BUILD = """
+func main() {
+  s = "";
+  i = 0;
+  while (i < 20000) {
+    s = s + "line " + "of output; ";
+    if (i > 10000) { s = s + "more; "; }
+    i = i + 1;
+  }
+  print(s == "");
+}
+"""
+
+BENCHMARKS = {
+    "arith_loop": ARITH_LOOP,
+    "compare_loop": COMPARE_LOOP,
+    "reduction_loop": REDUCTION_LOOP,
+    "invariant_loop": INVARIANT_LOOP,
+    "helper_calls": HELPER_CALLS,
+    "fib": FIB,
+    "closures": CLOSURES,
+    "object_passing": OBJECT_PASSING,
+    "local_objects": LOCAL_OBJECTS,
+    "proto_methods": PROTO_METHODS,
+    "string_build": STRING_BUILD,
+}
+
+CONFIGS = {
+    "generic": {"quicken": False, "opt_level": 0},
+    "quickened": {"quicken": True, "opt_level": 0},
+    "default": {},
+    "O2": {"opt_level": 2},
+}
+
+
+def time_program(program, config, repeat=3):
+    best = None
+    for _ in range(repeat):
+        interpreter = Interpreter(console_output=False, **config)
+        start = time.perf_counter()
+        interpreter.run(program)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, interpreter
+
+
+def print_site_stats(interpreter):
+    for stats in interpreter.get_op_site_stats():
+        types = ",".join(stats["types"])
+        print(
+            f"    {stats['op']:>3} {stats['state']:<12} ({types}) "
+            f"hits={stats['hits']} misses={stats['misses']} deopts={stats['deopts']}"
+        )
+
+
+def print_member_site_stats(interpreter):
+    for stats in interpreter.get_member_site_stats():
+        print(f"    .{stats['member']:<10} hits={stats['hits']} misses={stats['misses']}")
+
+
+def print_pass_timings(interpreter):
+    for name, seconds in interpreter.get_pass_timings():
+        print(f"    pass {name:<20} {seconds * 1000:8.3f} ms")
+
+
+MEMORY_COUNT = 2000000
+
+
+# the runtime classes as they were laid out before __slots__: a __dict__ per
+# instance, which also held an object's members
+class DictValue:
+    def __init__(self, t, v=None):
+        self.t = t
+        self.v = v
+
+
+class DictObject:
+    def __init__(self):
+        self.proto = DictValue(Type.NIL, None)
+        self.proto.heap = True
+        self.type = Type.OBJECT
+
+
+def new_value(i):
+    return Value(Type.INT, i)
+
+
+def new_object(i):
+    obj = Object()
+    obj.set_member("x", Value(Type.INT, i))
+    obj.set_member("y", Value(Type.INT, i))
+    return Value(Type.OBJECT, obj)
+
+
+def new_dict_value(i):
+    return DictValue(Type.INT, i)
+
+
+def new_dict_object(i):
+    obj = DictObject()
+    obj.x = DictValue(Type.INT, i)
+    obj.y = DictValue(Type.INT, i)
+    return DictValue(Type.OBJECT, obj)
+
+
+# bytes allocated per call of make, over MEMORY_COUNT calls
+def bytes_per_instance(make):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [make(i) for i in range(MEMORY_COUNT)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del instances
+    # the list holding the instances is not part of them
+    return (used - 8 * MEMORY_COUNT) / MEMORY_COUNT
+
+
+def memory_benchmark():
+    print(f"memory ({MEMORY_COUNT} instances, bytes each)")
+    rows = [
+        ("int value", new_dict_value, new_value),
+        ("object, 2 members", new_dict_object, new_object),
+    ]
+    for label, before, after in rows:
+        old = bytes_per_instance(before)
+        new = bytes_per_instance(after)
+        print(f"  {label:<18} {old:8.1f} -> {new:8.1f}")
+
+
+def main(names):
+    if names == ["memory"]:
+        memory_benchmark()
+        return
+    for name in names or BENCHMARKS:
+        print(name)
+        for config_name, config in CONFIGS.items():
+            elapsed, interpreter = time_program(BENCHMARKS[name], config)
+            allocations = interpreter.get_allocation_stats()
+            print(
+                f"  {config_name:<10} {elapsed * 1000:8.1f} ms"
+                f"  scopes: {allocations['scopes allocated']} allocated,"
+                f" {allocations['scopes reused']} reused"
+            )
+        print_pass_timings(interpreter)
+        print_site_stats(interpreter)
+        print_member_site_stats(interpreter)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,247 @@
+from analysis_v4 import BUILTIN_FUNCS
+from element import Element
+from intbase import InterpreterBase
+from ops_v4 import BINARY_OPS, UNARY_OPS
+from passes_v4 import BLOCK_DEF, CSE_DEF, CSE_USE, INLINED_DEF, Pass
+
+# Common subexpression elimination and copy propagation.
+#
+# Within a function body, a pure expression (operators over literals and
+# variables, or an object member read like a.x) that is evaluated again while
+# its first evaluation is still available is replaced by a cse_use node that
+# returns the value saved by the first occurrence, which becomes a cse_def node.
+# Uses of operator results return a copy of the saved Value, like evaluating the
+# operator again would; uses of member reads return the member's Value itself,
+# like get_member would.
+#
+# Any variable can alias another one (ref parameters bind the caller's Value,
+# `b = a` shares an object's Value, and callee frames see the caller's
+# variables), and any object can be reached through several variables or
+# proto chains.  So every assignment (to a variable or an object member) and
+# every call except print/inputi ends the availability of everything.  Branches
+# and loop bodies only make expressions unavailable, never available.
+#
+# Copy propagation: after `b = a`, until the next assignment or call, b holds a
+# copy of a's value, so operands that read b read a instead (and match a's
+# expressions).  Operands of == and != are left alone, as objects compare by
+# Value identity there, and so are call arguments, which ref parameters bind.
+
+OPERAND = "operand"  # value only used by an operator
+ARGUMENT = "argument"  # value bound to a (possibly ref) parameter
+PURE_LEAVES = {
+    InterpreterBase.INT_DEF,
+    InterpreterBase.STRING_DEF,
+    InterpreterBase.BOOL_DEF,
+    InterpreterBase.NIL_DEF,
+    InterpreterBase.VAR_DEF,
+}
+EQUALITY_OPS = ("==", "!=")
+
+
+def _pure(node):
+    kind = node.elem_type
+    if kind in PURE_LEAVES:
+        return True
+    if kind in UNARY_OPS:
+        return _pure(node.get("op1"))
+    if kind in BINARY_OPS:
+        return _pure(node.get("op1")) and _pure(node.get("op2"))
+    return False
+
+
+# true if running the loop may assign a variable or member, or call code
+def _loop_kills(while_ast):
+    stack = [while_ast.get("condition")] + list(while_ast.get("statements"))
+    while stack:
+        node = stack.pop()
+        kind = node.elem_type
+        if kind in ("=", InterpreterBase.MCALL_DEF, INLINED_DEF):
+            return True
+        if kind == InterpreterBase.FCALL_DEF and node.get("name") not in BUILTIN_FUNCS:
+            return True
+        if kind == InterpreterBase.LAMBDA_DEF:
+            continue
+        for value in node.dict.values():
+            items = value if isinstance(value, list) else [value]
+            stack.extend(item for item in items if isinstance(item, Element))
+    return False
+
+
+class Available:
+    def __init__(self):
+        self.defs = {}  # expression key -> cse_def node
+        self.copies = {}  # variable -> the variable it was copied from
+        self.killed = False
+
+    def copy(self):
+        available = Available()
+        available.defs = dict(self.defs)
+        available.copies = dict(self.copies)
+        return available
+
+    def kill(self):
+        self.defs = {}
+        self.copies = {}
+        self.killed = True
+
+
+class CsePass(Pass):
+    name = "cse"
+    level = 2
+    requires = ("constant-folding",)
+
+    def run(self, program_ast):
+        self.short_circuit = self.options.get("short_circuit")
+        for func_ast in program_ast.get("functions"):
+            self.__statements(func_ast.get("statements"), Available())
+        self.__drop_unused(program_ast)
+        return program_ast
+
+    # first occurrences that were never reused go back to plain expressions
+    def __drop_unused(self, node):
+        for key, value in node.dict.items():
+            items = value if isinstance(value, list) else [value]
+            for i, item in enumerate(items):
+                if not isinstance(item, Element):
+                    continue
+                while item.elem_type == CSE_DEF and item.uses == 0:
+                    item = item.get("expression")
+                items[i] = item
+                self.__drop_unused(item)
+            if not isinstance(value, list):
+                node.dict[key] = items[0]
+
+    def __statements(self, statements, available):
+        for statement in statements:
+            self.__statement(statement, available)
+
+    def __statement(self, statement, available):
+        kind = statement.elem_type
+        if kind == "=":
+            target = statement.get("name")
+            expr = statement.get("expression")
+            statement.dict["expression"] = self.__expr(expr, available)
+            available.kill()
+            if expr.elem_type == InterpreterBase.VAR_DEF:
+                source = expr.get("name")
+                if "." not in target + source and target != source:
+                    available.copies[target] = source
+        elif kind == InterpreterBase.RETURN_DEF:
+            if statement.get("expression") is not None:
+                statement.dict["expression"] = self.__expr(statement.get("expression"), available)
+        elif kind == InterpreterBase.IF_DEF:
+            statement.dict["condition"] = self.__expr(statement.get("condition"), available)
+            killed = False
+            for key in ("statements", "else_statements"):
+                if statement.get(key) is not None:
+                    branch = available.copy()
+                    self.__statements(statement.get(key), branch)
+                    killed = killed or branch.killed
+            if killed:
+                available.kill()
+        elif kind == InterpreterBase.WHILE_DEF:
+            # the condition and body run again after the body, so only what the
+            # body leaves alone stays available through the loop
+            if _loop_kills(statement):
+                available.kill()
+            inside = available.copy()
+            statement.dict["condition"] = self.__expr(statement.get("condition"), inside)
+            self.__statements(statement.get("statements"), inside)
+        elif kind in (InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF, INLINED_DEF):
+            self.__expr(statement, available)
+        elif kind == BLOCK_DEF:
+            # like a branch, the block runs in a scope of its own, whose
+            # variables are gone after it
+            inside = available.copy()
+            self.__statements(statement.get("statements"), inside)
+            if inside.killed:
+                available.kill()
+
+    # returns the node to evaluate in place of expr_ast
+    def __expr(self, expr_ast, available, position=None):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.VAR_DEF:
+            name = expr_ast.get("name")
+            if "." in name:
+                if position == ARGUMENT:
+                    return expr_ast
+                return self.__reuse(expr_ast, available, [])
+            if position == OPERAND and name in available.copies:
+                expr_ast.dict["name"] = available.copies[name]
+            return expr_ast
+
+        if kind in BINARY_OPS or kind in UNARY_OPS:
+            operand = None if kind in EQUALITY_OPS else OPERAND
+            keys = ["op1"] if kind in UNARY_OPS else ["op1", "op2"]
+            if not _pure(expr_ast):
+                for key in keys:
+                    expr_ast.dict[key] = self.__operand(expr_ast, key, available, operand)
+                return expr_ast
+            return self.__reuse(expr_ast, available, keys, operand)
+
+        if kind in (InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF, INLINED_DEF):
+            expr_ast.dict["args"] = [
+                self.__expr(arg, available, ARGUMENT) for arg in expr_ast.get("args")
+            ]
+            if kind == INLINED_DEF:
+                # the body runs in a frame of its own, where names may mean
+                # something else
+                self.__statements(expr_ast.get("statements"), Available())
+            if kind != InterpreterBase.FCALL_DEF or expr_ast.get("name") not in BUILTIN_FUNCS:
+                available.kill()
+            return expr_ast
+
+        if kind == InterpreterBase.LAMBDA_DEF:
+            self.__statements(expr_ast.get("statements"), Available())
+        return expr_ast
+
+    # a short-circuited right operand may not run, so what it makes available
+    # does not outlive it
+    def __operand(self, op_ast, key, available, position):
+        if key == "op2" and self.short_circuit and op_ast.elem_type in ("&&", "||"):
+            branch = available.copy()
+            result = self.__expr(op_ast.get(key), branch, position)
+            if branch.killed:
+                available.kill()
+            return result
+        return self.__expr(op_ast.get(key), available, position)
+
+    # a use of the available def of this pure expression, or else the
+    # expression as a def that later occurrences may use
+    def __reuse(self, expr_ast, available, keys, position=None):
+        key = self.__key(expr_ast, available)
+        cse_def = available.defs.get(key)
+        if cse_def is not None:
+            cse_def.uses += 1
+            use = Element(CSE_USE, expression=expr_ast)
+            use.definition = cse_def
+            use.copy_result = expr_ast.elem_type != InterpreterBase.VAR_DEF
+            return use
+        for op_key in keys:
+            expr_ast.dict[op_key] = self.__operand(expr_ast, op_key, available, position)
+        cse_def = Element(CSE_DEF, expression=expr_ast)
+        cse_def.uses = 0
+        cse_def.value = None
+        available.defs[key] = cse_def
+        return cse_def
+
+    # structural key of a pure expression, with copies propagated where the
+    # value is only used as an operand
+    def __key(self, expr_ast, available, identity=False):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.VAR_DEF:
+            parts = expr_ast.get("name").split(".")
+            if len(parts) > 1 or not identity:
+                # a copy holds the same object, so its members are the same
+                parts[0] = available.copies.get(parts[0], parts[0])
+            return (kind, ".".join(parts))
+        if kind in UNARY_OPS:
+            return (kind, self.__key(expr_ast.get("op1"), available))
+        if kind in BINARY_OPS:
+            identity = kind in EQUALITY_OPS
+            return (
+                kind,
+                self.__key(expr_ast.get("op1"), available, identity),
+                self.__key(expr_ast.get("op2"), available, identity),
+            )
+        return (kind, expr_ast.get("val"))
@@ -1,8 +1,42 @@
+from type_valuev4 import Type, copy_value
+
+
+# copies of the cells of the given variables, for a closure to keep.  A call
+# only binds the ones that do not hold an object or closure (see
+# __prepare_env_with_closed_variables), so the others are left out; variables
+# that share a cell (a ref parameter and its argument) share its copy.
+def capture_cells(env, names):
+    cells = {}
+    copies = {}
+    for name in names:
+        value = env.get(name)
+        if value is None or value.t in (Type.CLOSURE, Type.OBJECT):
+            continue
+        if id(value) not in copies:
+            copies[id(value)] = copy_value(value)
+            copies[id(value)].heap = True  # held by the closure
+        cells[name] = copies[id(value)]
+    return cells
+
+
+# Scope pooling.
+#
+# Every call, and every block that needs a scope, pushes a dict that is thrown
+# away when it is popped.  Nothing else keeps a scope dict (closures keep
+# copies of the cells they need, see capture_cells), so pop() clears it and
+# keeps it in a pool that new_scope() and push() take from, up to POOL_SIZE of
+# them.  scopes_allocated and scopes_reused count the dicts made and recycled.
+POOL_SIZE = 256
+
+
 # The EnvironmentManager class keeps a mapping between each variable name (aka symbol)
 # in a brewin program and the Value object, which stores a type, and a value.
 class EnvironmentManager:
     def __init__(self):
         self.environment = [{}]
+        self.pool = []  # cleared scope dicts
+        self.scopes_allocated = 0
+        self.scopes_reused = 0
 
     # returns a VariableDef object
     def get(self, symbol):
@@ -30,16 +64,54 @@ class EnvironmentManager:
     def create(self, symbol, value):
         self.environment[-1][symbol] = value
 
+    # an empty dict for the caller to fill in and push()
+    def new_scope(self):
+        if self.pool:
+            self.scopes_reused += 1
+            return self.pool.pop()
+        self.scopes_allocated += 1
+        return {}
+
     # used when we enter a nested block to create a new environment for that block
     def push(self, env = None):
         if env is None:
-            self.environment.append({})  # [{}] -> [{}, {}]
+            self.environment.append(self.new_scope())  # [{}] -> [{}, {}]
         else:
             self.environment.append(env)
 
     # used when we exit a nested block to discard the environment for that block
     def pop(self):
-        self.environment.pop()
+        scope = self.environment.pop()
+        if len(self.pool) < POOL_SIZE:
+            scope.clear()
+            self.pool.append(scope)
+
+    # number of scopes currently pushed; pass it to symbols_since() later on
+    def depth(self):
+        return len(self.environment)
+
+    # the Value of a symbol that the scope at the given depth (see depth()) holds
+    def get_at(self, depth, symbol):
+        return self.environment[depth][symbol]
+
+    # like get(), but only looks in the scopes pushed at or after the given depth
+    def get_since(self, depth, symbol):
+        for i in range(len(self.environment) - 1, depth - 1, -1):
+            if symbol in self.environment[i]:
+                return self.environment[i][symbol]
+        return None
+
+    # yields the symbols defined in the scopes pushed at or after the given depth
+    def symbols_since(self, depth):
+        for env in self.environment[depth:]:
+            yield from env
+
+    # the environment a closure created now keeps (see type_valuev4.Closure),
+    # holding copies of the given variables
+    def capture(self, names):
+        captured = EnvironmentManager()
+        captured.environment = [capture_cells(self, names)]
+        return captured
 
     def __enumerate(self):
         captured_so_far = set()
@@ -0,0 +1,243 @@
+from analysis_v4 import CallGraph, base_name, children, param_names
+from intbase import InterpreterBase
+from ops_v4 import BINARY_OPS, UNARY_OPS
+from passes_v4 import (
+    CSE_DEF,
+    CSE_USE,
+    INDUCTION_MUL_DEF,
+    INLINED_DEF,
+    INVARIANT_DEF,
+    Pass,
+)
+
+# Escape analysis.
+#
+# Arguments and return values are passed by value, so each one is copied, even
+# when the Value being copied is one that nothing else refers to.  Such Values
+# are called owned here:
+#   - the results of literals, operators and @ (a new Value each time), and of
+#     calls (the callee copied what it returned), except for the shared nil
+#     Value that calls without a return statement give, which the interpreter
+#     checks for
+#   - a function's own variable, when it is returned: the frame goes away with
+#     the return, so if the variable's object cannot be reached from anywhere
+#     else, nobody can tell the returned Value from a copy
+# Call nodes get owned_args and return nodes owned, and the interpreter skips the
+# copies of owned Values.
+#
+# A variable of a top-level function (or of an inlined body, which runs in a
+# scope of its own) does not escape if the function's own code only uses it as
+# `v = @` (or assigns it other owned Values), `v.member`, and `return v`, and
+# nothing the function calls can look it up by name (see
+# CallGraph.callee_names).  Lambdas and inlined bodies in the function count as
+# code it calls.  Whether the variable is the function's own is only known at
+# runtime, as the first assignment writes to a caller's variable of the same
+# name if there is one, so the interpreter checks that it lives in the frame
+# (at or above local_base).
+#
+# Returning such a variable also requires that no Value held by its object gets
+# out, so member reads only go to operators, conditions, print and return
+# (which copies them); the return node gets `local`, the variable's name.
+#
+# A variable that does not escape, is not returned and is only ever assigned @
+# has an object that is never seen as a whole.  Its object is replaced by a
+# Record: `v = @` binds the variable to a list with a slot per member (a Value,
+# or None for a member not set yet, which reads as nil), and member reads and
+# writes index the slot directly (see __new_record, __assign and __eval_name in
+# interpreterv4.py).  Variables that use proto, which an Object has without it
+# being assigned, keep the object.
+
+OWNED_KINDS = {
+    InterpreterBase.INT_DEF,
+    InterpreterBase.STRING_DEF,
+    InterpreterBase.BOOL_DEF,
+    InterpreterBase.OBJ_DEF,
+    InterpreterBase.LAMBDA_DEF,
+    InterpreterBase.FCALL_DEF,
+    InterpreterBase.MCALL_DEF,
+    INLINED_DEF,
+    INVARIANT_DEF,
+    INDUCTION_MUL_DEF,
+} | set(BINARY_OPS) | set(UNARY_OPS)
+CALL_KINDS = (InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF, INLINED_DEF)
+
+
+# true if evaluating the expression gives a Value that nothing else refers to
+def owned(expr_ast):
+    if expr_ast.elem_type == CSE_USE:
+        return expr_ast.copy_result
+    return expr_ast.elem_type in OWNED_KINDS
+
+
+def _reserved(member):
+    return member == "proto"
+
+
+# the names used anywhere in a subtree
+def _names(node):
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        kind = node.elem_type
+        if kind in (InterpreterBase.VAR_DEF, "="):
+            names.add(base_name(node.get("name")))
+        elif kind in (InterpreterBase.FCALL_DEF, InterpreterBase.ARG_DEF, InterpreterBase.REFARG_DEF):
+            names.add(node.get("name"))
+        elif kind == InterpreterBase.MCALL_DEF:
+            names.add(node.get("objref"))
+        stack.extend(children(node))
+    return names
+
+
+# the slots of a variable whose object was replaced, shared by its nodes
+class Record:
+    def __init__(self, name, members):
+        self.name = name
+        self.slots = {member: i for i, member in enumerate(sorted(members))}
+        self.size = len(self.slots)
+
+
+class VariableUses:
+    def __init__(self):
+        self.escapes = False
+        self.assigned = False  # assigned something other than @
+        self.creations = []  # `v = @` statements
+        self.members = []  # (member read or write node, member name)
+        self.returns = []  # `return v` statements
+        self.leaks = False  # a member's Value may be kept by something else
+
+
+def _var(uses, name):
+    return uses.setdefault(name, VariableUses())
+
+
+class EscapeAnalysisPass(Pass):
+    name = "escape-analysis"
+    level = 2
+
+    def __init__(self, options, manager):
+        super().__init__(options, manager)
+        self.call_graph = None  # built on first use
+
+    def run(self, program_ast):
+        if self.call_graph is None:
+            self.call_graph = CallGraph(self.manager.program_ast)
+        for func_ast in program_ast.get("functions"):
+            self.__replace_objects(func_ast, param_names(func_ast))
+            for inlined_ast in self.__mark_owned(func_ast):
+                formals = {formal.get("name") for formal in inlined_ast.get("formals")}
+                self.__replace_objects(inlined_ast, formals)
+        return program_ast
+
+    # returns the inlined bodies, which get their variables replaced as well
+    def __mark_owned(self, func_ast):
+        inlined = []
+        stack = [func_ast]
+        while stack:
+            node = stack.pop()
+            kind = node.elem_type
+            if kind in CALL_KINDS:
+                node.owned_args = [owned(arg) for arg in node.get("args")]
+                if kind == INLINED_DEF:
+                    inlined.append(node)
+            elif kind == InterpreterBase.RETURN_DEF and node.get("expression") is not None:
+                node.owned = owned(node.get("expression"))
+            stack.extend(children(node))
+        return inlined
+
+    # body_ast: a top-level function or an inlined body, which runs in a scope
+    # of its own holding the params
+    def __replace_objects(self, body_ast, params):
+        uses = {}
+        for statement in body_ast.get("statements"):
+            self.__visit(statement, uses, False)
+        if not uses:
+            return
+        visible = self.call_graph.callee_names(body_ast) | params
+        visible.add(InterpreterBase.THIS_DEF)
+        for name, var in uses.items():
+            if var.escapes or name in visible or not (var.creations or var.assigned):
+                continue
+            if var.returns:
+                if not var.leaks:
+                    for return_ast in var.returns:
+                        return_ast.local = name
+                continue
+            if var.assigned or any(_reserved(member) for _, member in var.members):
+                continue
+            record = Record(name, {member for _, member in var.members})
+            for assign_ast in var.creations:
+                assign_ast.record = record
+            for node, member in var.members:
+                node.slot = record.slots[member]
+                if node.elem_type == InterpreterBase.VAR_DEF:
+                    node.record = record
+
+    # safe: the value of the node is only used by an operator, a condition,
+    # print or a return, which do not keep it
+    def __visit(self, node, uses, safe):
+        kind = node.elem_type
+        if kind in (InterpreterBase.LAMBDA_DEF, INLINED_DEF):
+            # runs code of its own, which may do anything with the names it uses
+            for arg in node.get("args") if kind == INLINED_DEF else ():
+                self.__visit(arg, uses, False)
+            body = node.get("statements")
+            for name in set().union(*(_names(statement) for statement in body)):
+                _var(uses, name).escapes = True
+            return
+        if kind == InterpreterBase.VAR_DEF:
+            name, _, member = node.get("name").partition(".")
+            if not member:
+                _var(uses, name).escapes = True
+                return
+            _var(uses, name).members.append((node, member))
+            if not safe:
+                _var(uses, name).leaks = True
+            return
+        if kind == "=":
+            name, _, member = node.get("name").partition(".")
+            expr_ast = node.get("expression")
+            if member:
+                _var(uses, name).members.append((node, member))
+                if not owned(expr_ast):
+                    # the member is then a Value that something else holds
+                    _var(uses, name).leaks = True
+            elif expr_ast.elem_type == InterpreterBase.OBJ_DEF:
+                _var(uses, name).creations.append(node)
+            elif owned(expr_ast) or expr_ast.elem_type == InterpreterBase.NIL_DEF:
+                _var(uses, name).assigned = True
+            else:
+                _var(uses, name).escapes = True
+            self.__visit(expr_ast, uses, False)
+            return
+        if kind == InterpreterBase.RETURN_DEF:
+            expr_ast = node.get("expression")
+            if expr_ast is None:
+                return
+            if expr_ast.elem_type == InterpreterBase.VAR_DEF and "." not in expr_ast.get("name"):
+                _var(uses, expr_ast.get("name")).returns.append(node)
+                return
+            self.__visit(expr_ast, uses, True)
+            return
+        if kind in (InterpreterBase.IF_DEF, InterpreterBase.WHILE_DEF):
+            self.__visit(node.get("condition"), uses, True)
+            for key in ("statements", "else_statements"):
+                for statement in node.get(key) or []:
+                    self.__visit(statement, uses, False)
+            return
+        if kind == InterpreterBase.FCALL_DEF:
+            _var(uses, node.get("name")).escapes = True
+            safe = node.get("name") == "print"
+            for arg in node.get("args"):
+                self.__visit(arg, uses, safe)
+            return
+        if kind == InterpreterBase.MCALL_DEF:
+            _var(uses, node.get("objref")).escapes = True
+            for arg in node.get("args"):
+                self.__visit(arg, uses, False)
+            return
+        operand = kind in BINARY_OPS or kind in UNARY_OPS
+        wrapper = kind in (CSE_DEF, CSE_USE, INVARIANT_DEF)
+        for child in children(node):
+            self.__visit(child, uses, operand or (wrapper and safe))
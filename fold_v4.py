@@ -0,0 +1,180 @@
+from analysis_v4 import children
+from element import Element
+from intbase import InterpreterBase
+from ops_v4 import BINARY_OPS, UNARY_OPS, lookup
+from passes_v4 import BLOCK_DEF, INLINED_DEF, Pass
+from type_valuev4 import Type, Value, box, flat, unbox
+
+# Constant folding and dead-code elimination.
+#
+# Operators whose operands are all literals are replaced by the literal they
+# evaluate to, using the interpreter's own dispatch entries (and so its
+# promotion rules).  Operations that fail at runtime, with a Brewin type error
+# or otherwise (e.g. dividing by zero), are left in place so that they still
+# fail when run.  Dead-code elimination then drops the branches and loops that
+# a constant condition rules out, and the statements after a return.
+
+LITERAL_TYPES = {
+    InterpreterBase.INT_DEF: Type.INT,
+    InterpreterBase.STRING_DEF: Type.STRING,
+    InterpreterBase.BOOL_DEF: Type.BOOL,
+    InterpreterBase.NIL_DEF: Type.NIL,
+}
+
+# statements that do something when run; the interpreter skips any other
+# (expression) statement
+EXECUTED_STATEMENTS = {
+    "=",
+    InterpreterBase.FCALL_DEF,
+    InterpreterBase.MCALL_DEF,
+    InterpreterBase.RETURN_DEF,
+    InterpreterBase.IF_DEF,
+    InterpreterBase.WHILE_DEF,
+    BLOCK_DEF,
+    INLINED_DEF,
+}
+
+
+# the Value a literal node evaluates to, or None if the node is not a literal
+def literal_value(node):
+    value_type = LITERAL_TYPES.get(node.elem_type)
+    if value_type is None:
+        return None
+    return Value(value_type, node.get("val"))
+
+
+def literal_node(value):
+    if value.t == Type.INT:
+        return Element(InterpreterBase.INT_DEF, val=value.v)
+    if value.t == Type.STRING:
+        return Element(InterpreterBase.STRING_DEF, val=flat(value.v))
+    if value.t == Type.BOOL:
+        return Element(InterpreterBase.BOOL_DEF, val=value.v)
+    return None
+
+
+# the truth value of a constant if/while condition, or None if it is not known
+def constant_condition(node):
+    value = literal_value(node)
+    if value is None or value.t not in (Type.INT, Type.BOOL):
+        return None
+    return value.v != 0 if value.t == Type.INT else value.v
+
+
+class ConstantFoldPass(Pass):
+    name = "constant-folding"
+    level = 1
+
+    def run(self, program_ast):
+        self.__fold_children(program_ast)
+        return program_ast
+
+    def __fold_children(self, node):
+        for key, value in node.dict.items():
+            if isinstance(value, Element):
+                node.dict[key] = self.__fold(value)
+            elif isinstance(value, list):
+                node.dict[key] = [
+                    self.__fold(item) if isinstance(item, Element) else item
+                    for item in value
+                ]
+
+    def __fold(self, node):
+        self.__fold_children(node)
+        kind = node.elem_type
+        if kind in UNARY_OPS:
+            operand = literal_value(node.get("op1"))
+            if operand is None:
+                return node
+            return self.__evaluate(node, lookup(kind, operand.t), operand)
+        if kind not in BINARY_OPS:
+            return node
+
+        left = literal_value(node.get("op1"))
+        if left is not None and self.options.get("short_circuit") and kind in ("&&", "||"):
+            # the right operand is never evaluated, whatever it is
+            decisive = kind == "||"
+            if left.t in (Type.INT, Type.BOOL) and (left.v != 0) == decisive:
+                return Element(InterpreterBase.BOOL_DEF, val=decisive)
+        right = literal_value(node.get("op2"))
+        if left is None or right is None:
+            return node
+        return self.__evaluate(node, lookup(kind, left.t, right.t), left, right)
+
+    # the literal the operation evaluates to, or the node itself if it fails
+    def __evaluate(self, node, entry, *operands):
+        if entry.error is not None:
+            return node
+        try:
+            result = entry.raw(*(unbox(operand) for operand in operands))
+        except ArithmeticError:
+            return node
+        return literal_node(box(result)) or node
+
+
+class DeadCodePass(Pass):
+    name = "dead-code"
+    level = 1
+    requires = ("constant-folding",)
+
+    def run(self, program_ast):
+        self.__visit(program_ast)
+        return program_ast
+
+    # prunes the statement lists of the node and of everything nested in it,
+    # innermost first
+    def __visit(self, node):
+        for child in children(node):
+            self.__visit(child)
+        for key in ("statements", "else_statements"):
+            if node.get(key) is not None:
+                node.dict[key] = self.__prune(node.get(key))
+
+    def __prune(self, statements):
+        pruned = []
+        for statement in statements:
+            statement = self.__simplify(statement)
+            if statement is None:
+                continue
+            pruned.append(statement)
+            if always_returns(statement):
+                break
+        return pruned
+
+    # the statement with constant control flow resolved, or None if it has no
+    # effect at all
+    def __simplify(self, statement):
+        kind = statement.elem_type
+        if kind not in EXECUTED_STATEMENTS:
+            return None
+        if kind == InterpreterBase.WHILE_DEF:
+            if constant_condition(statement.get("condition")) is False:
+                return None
+            return statement
+        if kind == BLOCK_DEF and not statement.get("statements"):
+            return None
+        if kind != InterpreterBase.IF_DEF:
+            return statement
+        taken = constant_condition(statement.get("condition"))
+        if taken is None:
+            return statement
+        branch = statement.get("statements" if taken else "else_statements")
+        if not branch:
+            return None
+        # the branch keeps its own scope, as variables it creates must not
+        # outlive it
+        return Element(BLOCK_DEF, statements=branch)
+
+
+# true if running the statement always ends in a return
+def always_returns(statement):
+    kind = statement.elem_type
+    if kind == InterpreterBase.RETURN_DEF:
+        return True
+    if kind == BLOCK_DEF:
+        return any(always_returns(s) for s in statement.get("statements"))
+    if kind == InterpreterBase.IF_DEF and statement.get("else_statements"):
+        return any(always_returns(s) for s in statement.get("statements")) and any(
+            always_returns(s) for s in statement.get("else_statements")
+        )
+    return False
@@ -0,0 +1,59 @@
+from type_valuev4 import Object, Type, Value
+
+# Inline caches for member reads and method calls.
+#
+# Every dotted variable node (a.x) and method call node gets a MemberSite,
+# which remembers where its member was found the last time: the receiver's
+# Shape, and the offset in the receiver or the prototype holding the member.
+# A receiver with that Shape has the member at the same offset, or else does
+# not have it at all; in the latter case, the member is still on the same
+# prototype if the receiver's proto is the same object and no proto chain
+# changed since (see Object.chain_version).  Otherwise the site looks the
+# member up again, and caches what it finds.
+
+_UNCACHED = object()  # a Shape no object has
+
+
+class MemberSite:
+    def __init__(self, member):
+        self.member = member
+        self.shape = _UNCACHED  # receiver Shape the cached lookup was for
+        self.holder = None  # prototype holding the member, None if own
+        self.proto = None  # the receiver's proto, for a prototype member
+        self.version = None  # Object.chain_version, for a prototype member
+        self.offset = None
+        self.hits = 0  # lookups answered by the cache
+        self.misses = 0  # lookups that walked the proto chain
+
+    # the member's Value, or a nil Value if obj has no such member
+    def lookup(self, obj):
+        if obj.shape is self.shape:
+            holder = self.holder
+            if holder is None:
+                self.hits += 1
+                return obj.values[self.offset]
+            if obj.proto.v is self.proto and self.version == Object.chain_version:
+                self.hits += 1
+                return holder.values[self.offset]
+        return self.__miss(obj)
+
+    def __miss(self, obj):
+        self.misses += 1
+        obj.materialize()
+        if self.member == "proto":
+            return obj.proto
+        holder, offset = obj.find_member(self.member)
+        if holder is None:
+            return Value(Type.NIL, None)
+        self.shape = obj.shape
+        self.offset = offset
+        if holder is obj:
+            self.holder = None
+        else:
+            self.holder = holder
+            self.proto = obj.proto.v
+            self.version = Object.chain_version
+        return holder.values[offset]
+
+    def stats(self):
+        return {"member": self.member, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,262 @@
+from analysis_v4 import BUILTIN_FUNCS
+from intbase import InterpreterBase
+from ops_v4 import BINARY_OPS, UNARY_OPS, lookup
+from passes_v4 import (
+    BLOCK_DEF,
+    CSE_DEF,
+    CSE_USE,
+    INDUCTION_MUL_DEF,
+    INLINED_DEF,
+    INVARIANT_DEF,
+    Pass,
+)
+from type_valuev4 import Type
+
+# Static type inference.
+#
+# A flow-sensitive pass over each function body that works out which variables
+# hold a known type at each point.  Operators whose operand types are proven
+# get the dispatch entry's (unboxed) handler for those types as their
+# static_handler, which the interpreter calls directly, and if/while nodes whose
+# condition is proven to be a bool get typed_condition, so the type checks on
+# those are skipped.
+# Everything else keeps the dynamic checks.
+#
+# What makes a type fact go away:
+#   - a call other than print/inputi: the callee sees and can assign every
+#     variable of its callers
+#   - an assignment: the assigned variable may be an alias of any other one (a
+#     ref parameter, or an object Value shared by `b = a`), so other variables
+#     only keep their type if it is the assigned type
+#   - leaving a scope: a variable that was not known to exist before the scope
+#     was entered may have been created in it, and is gone afterwards
+# A variable read returns the variable's Value itself, which a call made while
+# evaluating the other operand can retype, so such operators are not typed.
+
+LITERAL_TYPES = {
+    InterpreterBase.INT_DEF: Type.INT,
+    InterpreterBase.STRING_DEF: Type.STRING,
+    InterpreterBase.BOOL_DEF: Type.BOOL,
+    InterpreterBase.NIL_DEF: Type.NIL,
+    InterpreterBase.OBJ_DEF: Type.OBJECT,
+    InterpreterBase.LAMBDA_DEF: Type.CLOSURE,
+}
+MAX_LOOP_PASSES = 8
+
+
+class TypeState:
+    def __init__(self, defined=()):
+        self.types = {}  # variable -> Type it is known to hold
+        self.defined = set(defined)  # variables known to exist
+        self.calls = 0  # calls seen so far, to tell if an expression made one
+
+    def copy(self):
+        state = TypeState(self.defined)
+        state.types = dict(self.types)
+        state.calls = self.calls
+        return state
+
+    def call(self):
+        self.types = {}
+        self.calls += 1
+
+    def assign(self, name, value_type):
+        self.types = {
+            other: t for other, t in self.types.items() if other != name and t == value_type
+        }
+        if value_type is not None:
+            self.types[name] = value_type
+        self.defined.add(name)
+
+    # the state after a nested scope that was entered in the state `outer`
+    def leave(self, outer):
+        self.types = {
+            name: t for name, t in self.types.items() if name in outer.defined
+        }
+        self.defined &= outer.defined
+        return self
+
+    def same_as(self, other):
+        return self.types == other.types and self.defined == other.defined
+
+
+# the facts that hold on both paths; None stands for a path that returned
+def join(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    state = TypeState(a.defined & b.defined)
+    state.types = {name: t for name, t in a.types.items() if b.types.get(name) == t}
+    state.calls = max(a.calls, b.calls)
+    return state
+
+
+class TypeInferencePass(Pass):
+    name = "type-inference"
+    level = 2
+    requires = ("constant-folding",)
+
+    def run(self, program_ast):
+        self.short_circuit = self.options.get("short_circuit")
+        self.annotate = True
+        for func_ast in program_ast.get("functions"):
+            self.__body(func_ast)
+        return program_ast
+
+    # function, lambda and inlined bodies start out knowing nothing but their
+    # parameters' names
+    def __body(self, func_ast):
+        formals = func_ast.get("formals" if func_ast.elem_type == INLINED_DEF else "args")
+        params = {formal.get("name") for formal in formals}
+        self.__statements(func_ast.get("statements"), TypeState(params))
+
+    # returns the state after the statements, or None if they always return
+    def __statements(self, statements, state):
+        for statement in statements:
+            if state is None:
+                return None
+            state = self.__statement(statement, state)
+        return state
+
+    def __scope(self, statements, state):
+        inner = self.__statements(statements, state.copy())
+        return None if inner is None else inner.leave(state)
+
+    def __statement(self, statement, state):
+        kind = statement.elem_type
+        if kind == "=":
+            return self.__assign(statement, state)
+        if kind == InterpreterBase.RETURN_DEF:
+            if statement.get("expression") is not None:
+                self.__expr(statement.get("expression"), state)
+            return None
+        if kind == InterpreterBase.IF_DEF:
+            self.__condition(statement, state)
+            taken = self.__scope(statement.get("statements"), state)
+            if statement.get("else_statements") is None:
+                return join(taken, state)
+            return join(taken, self.__scope(statement.get("else_statements"), state))
+        if kind == InterpreterBase.WHILE_DEF:
+            return self.__while(statement, state)
+        if kind == BLOCK_DEF:
+            return self.__scope(statement.get("statements"), state)
+        if kind in (InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF, INLINED_DEF):
+            self.__expr(statement, state)
+        return state
+
+    def __assign(self, assign_ast, state):
+        expr_ast = assign_ast.get("expression")
+        # an object value is evaluated a second time (see __assign), after
+        # whatever calls the first evaluation made
+        dry_run = state.copy()
+        self.__dry(lambda: self.__expr(expr_ast, dry_run))
+        if dry_run.calls != state.calls:
+            state.call()
+        value_type = self.__expr(expr_ast, state)
+        name = assign_ast.get("name")
+        if "." not in name:
+            state.assign(name, value_type)
+        return state
+
+    def __condition(self, cond_owner, state):
+        cond_type = self.__expr(cond_owner.get("condition"), state)
+        if self.annotate:
+            cond_owner.typed_condition = cond_type == Type.BOOL
+
+    # iterates the loop to a fixed point before annotating anything in it
+    def __while(self, while_ast, state):
+        head = state.copy()
+        for _ in range(MAX_LOOP_PASSES):
+            body = head.copy()
+            self.__dry(lambda: self.__loop_body(while_ast, body))
+            next_head = join(head, body)
+            if next_head.same_as(head):
+                break
+            head = next_head
+        else:
+            head = TypeState(state.defined)
+            head.calls = state.calls + 1
+        body = head.copy()
+        self.__loop_body(while_ast, body)
+        exit_state = head.copy()
+        self.__dry(lambda: self.__expr(while_ast.get("condition"), exit_state))
+        return exit_state
+
+    def __loop_body(self, while_ast, state):
+        self.__condition(while_ast, state)
+        after = self.__scope(while_ast.get("statements"), state)
+        if after is not None:
+            state.types = after.types
+            state.defined = after.defined
+            state.calls = after.calls
+        else:
+            state.types = {}
+
+    def __dry(self, analyze):
+        annotate = self.annotate
+        self.annotate = False
+        analyze()
+        self.annotate = annotate
+
+    # returns the Type the expression is proven to evaluate to, or None
+    def __expr(self, expr_ast, state):
+        kind = expr_ast.elem_type
+        if kind in LITERAL_TYPES:
+            if kind == InterpreterBase.LAMBDA_DEF:
+                self.__body(expr_ast)
+            return LITERAL_TYPES[kind]
+        if kind == InterpreterBase.VAR_DEF:
+            return state.types.get(expr_ast.get("name"))
+        if kind in BINARY_OPS:
+            return self.__binary(expr_ast, state)
+        if kind in UNARY_OPS:
+            operand_type = self.__expr(expr_ast.get("op1"), state)
+            return self.__typed(expr_ast, operand_type and lookup(kind, operand_type))
+        if kind in (InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF, INLINED_DEF):
+            return self.__call(expr_ast, state)
+        if kind in (CSE_DEF, INVARIANT_DEF, INDUCTION_MUL_DEF):
+            return self.__expr(expr_ast.get("expression"), state)
+        if kind == CSE_USE:
+            # the definition's value, and no assignment or call came in between
+            return self.__expr_type(expr_ast.get("expression"), state)
+        return None
+
+    def __binary(self, op_ast, state):
+        kind = op_ast.elem_type
+        left_type = self.__expr(op_ast.get("op1"), state)
+        calls = state.calls
+        if self.short_circuit and kind in ("&&", "||"):
+            right_state = state.copy()
+            right_type = self.__expr(op_ast.get("op2"), right_state)
+            if right_state.calls != calls:
+                state.call()
+        else:
+            right_type = self.__expr(op_ast.get("op2"), state)
+        if state.calls != calls or left_type is None or right_type is None:
+            return None
+        return self.__typed(op_ast, lookup(kind, left_type, right_type))
+
+    def __typed(self, op_ast, entry):
+        if not entry or entry.error is not None:
+            return None
+        if self.annotate:
+            op_ast.static_handler = entry.raw
+        return entry.result_type
+
+    def __call(self, call_ast, state):
+        for arg in call_ast.get("args"):
+            self.__expr(arg, state)
+        kind = call_ast.elem_type
+        if kind == InterpreterBase.FCALL_DEF and call_ast.get("name") in BUILTIN_FUNCS:
+            return Type.INT if call_ast.get("name") == "inputi" else Type.NIL
+        if kind == INLINED_DEF:
+            self.__body(call_ast)
+        state.call()
+        return None
+
+    # the type of a pure expression, without annotating it
+    def __expr_type(self, expr_ast, state):
+        types = []
+        self.__dry(lambda: types.append(self.__expr(expr_ast, state.copy())))
+        return types[0]
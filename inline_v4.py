@@ -0,0 +1,125 @@
+import copy
+
+from analysis_v4 import BUILTIN_FUNCS, CallGraph, children
+from element import Element
+from intbase import InterpreterBase
+from passes_v4 import INLINED_DEF, Pass
+
+# Function inlining.
+#
+# Replaces calls to small top-level functions by inlined nodes that hold a copy
+# of the callee's body.  The interpreter runs an inlined node like a call (the
+# arguments are evaluated and copied the same way, and the body gets a frame of
+# its own that callees can see), minus the name lookup, the arity checks and
+# the frame bookkeeping of a real call.  A callee is inlined if:
+#   - the call resolves statically: top-level functions take precedence over
+#     variables, so a call by name to one of them always reaches it
+#   - the function is never used as a value, as assigning a non-function to
+#     such a variable changes the function itself (see __assign)
+#   - it is not (mutually) recursive through static calls
+#   - its body has at most `inline_budget` nodes
+#
+# Functions are compiled lazily, so a callee may not have been folded yet when a
+# call to it is inlined, or may have been compiled all the way already.  The
+# body that gets inlined is the callee's as it was when it reached this pass
+# (the callee is brought there on demand), before its own calls were inlined.
+
+DEFAULT_INLINE_BUDGET = 40
+
+
+def _size(node):
+    return 1 + sum(_size(child) for child in children(node))
+
+
+class InlinePass(Pass):
+    name = "inline"
+    level = 2
+    requires = ("dead-code",)
+
+    def __init__(self, options, manager):
+        super().__init__(options, manager)
+        self.budget = options.get("inline_budget", DEFAULT_INLINE_BUDGET)
+        self.call_graph = None  # built on first use
+        self.referenced = None
+        self.candidates = {}  # (name, arity) -> function AST, or None if not inlined
+        self.bodies = {}  # id(candidate) -> its statements as of this pass
+
+    def run(self, program_ast):
+        if self.call_graph is None:
+            # any function may use a candidate as a value
+            self.call_graph = CallGraph(self.manager.program_ast)
+            self.referenced = self.call_graph.referenced_functions()
+        for func_ast in program_ast.get("functions"):
+            if self.__is_candidate(func_ast):
+                self.__body(func_ast)
+            self.__inline_calls(func_ast)
+        return program_ast
+
+    # the function called by a call to name with that many arguments, if it is
+    # to be inlined
+    def __candidate(self, name, arity):
+        key = (name, arity)
+        if key not in self.candidates:
+            func_ast = self.call_graph.func_table.get(name, {}).get(arity)
+            if func_ast is not None and (
+                name in self.referenced
+                or self.__recursive(func_ast)
+                or _size(func_ast) > self.budget
+            ):
+                func_ast = None
+            self.candidates[key] = func_ast
+        return self.candidates[key]
+
+    def __is_candidate(self, func_ast):
+        return self.__candidate(func_ast.get("name"), len(func_ast.get("args"))) is func_ast
+
+    def __body(self, func_ast):
+        if id(func_ast) not in self.bodies:
+            self.manager.compile(func_ast, until=self.name)
+            self.bodies[id(func_ast)] = copy.deepcopy(func_ast.get("statements"))
+        return self.bodies[id(func_ast)]
+
+    def __recursive(self, func_ast):
+        seen = set()
+        worklist = list(self.call_graph.summary(func_ast).static_calls)
+        while worklist:
+            callee = worklist.pop()
+            if callee is func_ast:
+                return True
+            if id(callee) in seen:
+                continue
+            seen.add(id(callee))
+            worklist.extend(self.call_graph.summary(callee).static_calls)
+        return False
+
+    # rewrites the calls among the node's descendants, including the ones in
+    # bodies inlined along the way
+    def __inline_calls(self, node):
+        for key, value in node.dict.items():
+            if isinstance(value, Element):
+                node.dict[key] = self.__inline_child(value)
+            elif isinstance(value, list):
+                node.dict[key] = [
+                    self.__inline_child(item) if isinstance(item, Element) else item
+                    for item in value
+                ]
+
+    def __inline_child(self, node):
+        self.__inline_calls(node)
+        if node.elem_type != InterpreterBase.FCALL_DEF or node.get("name") in BUILTIN_FUNCS:
+            return node
+        func_ast = self.__candidate(node.get("name"), len(node.get("args")))
+        if func_ast is None:
+            return node
+        # the callee is not recursive, so this terminates
+        statements = [
+            self.__inline_child(statement)
+            for statement in copy.deepcopy(self.__body(func_ast))
+        ]
+        return Element(
+            INLINED_DEF,
+            name=node.get("name"),
+            args=node.get("args"),
+            formals=func_ast.get("args"),
+            statements=statements,
+        )
@@ -1,15 +1,49 @@
 import copy
 from enum import Enum
 
+from analysis_v4 import BUILTIN_FUNCS, CallGraph, children
 from brewparse import parse_program
+from cse_v4 import CsePass
 from env_v4 import EnvironmentManager
+from escape_v4 import EscapeAnalysisPass
+from fold_v4 import ConstantFoldPass, DeadCodePass
+from infer_v4 import TypeInferencePass
+from inline_v4 import DEFAULT_INLINE_BUDGET, InlinePass
 from intbase import InterpreterBase, ErrorType
-from type_valuev4 import Object, Closure, Type, Value, create_value, get_printable
+from licm_v4 import LoopInvariantPass, StrengthReductionPass
+from loops_v4 import CountedLoopPass
+from ops_v4 import DISPATCH, OP_IDS, TYPE_SLOTS, dispatch_index
+from passes_v4 import (
+    BLOCK_DEF,
+    CSE_DEF,
+    CSE_USE,
+    INDUCTION_MUL_DEF,
+    INLINED_DEF,
+    INVARIANT_DEF,
+    PassManager,
+)
+from icache_v4 import MemberSite
+from quicken_v4 import OpSite
+from resolve_v4 import FrameResolutionPass, ScopeElisionPass
+from type_valuev4 import (
+    Object,
+    Closure,
+    RAW_TYPES,
+    Type,
+    Value,
+    box,
+    copy_value,
+    create_value,
+    get_printable,
+    unbox,
+    write_barrier,
+)
 
 
 class ExecStatus(Enum):
     CONTINUE = 1
     RETURN = 2
+    TAIL_CALL = 3  # return value is a (func_ast, env) pair to run in place of the caller
 
 
 # Main interpreter class
@@ -17,35 +51,221 @@ class Interpreter(InterpreterBase):
     # constants
     NIL_VALUE = create_value(InterpreterBase.NIL_DEF)
     TRUE_VALUE = create_value(InterpreterBase.TRUE_DEF)
+    # statement results, shared instead of making a tuple each time
+    CONTINUE_RESULT = (ExecStatus.CONTINUE, NIL_VALUE)
+    RETURN_NIL_RESULT = (ExecStatus.RETURN, NIL_VALUE)
     BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
+    LOGICAL_OPS = {"&&", "||"}
+    UNARY_OPS = {InterpreterBase.NEG_DEF, InterpreterBase.NOT_DEF}
+    CALL_DEFS = {InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF}
+    CELL_KINDS = {InterpreterBase.VAR_DEF, CSE_DEF, CSE_USE}
+    RAW_LITERALS = {InterpreterBase.INT_DEF, InterpreterBase.STRING_DEF, InterpreterBase.BOOL_DEF}
+    # AST passes (see passes_v4.py), each enabled from its own -O level
+    PASSES = (
+        ConstantFoldPass,
+        DeadCodePass,
+        InlinePass,
+        CountedLoopPass,
+        LoopInvariantPass,
+        StrengthReductionPass,
+        CsePass,
+        TypeInferencePass,
+        FrameResolutionPass,
+        ScopeElisionPass,
+        EscapeAnalysisPass,
+    )
+    MAX_OPT_LEVEL = 2
 
     # methods
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    # short_circuit: evaluate the right operand of && and || only when the left
+    # one does not decide the result (by default both sides are always evaluated)
+    # opt_level: which AST passes run before execution, from 0 (none) to 2
+    # inline_budget: largest function (in AST nodes) the -O2 inliner inlines
+    def __init__(
+        self,
+        console_output=True,
+        inp=None,
+        trace_output=False,
+        quicken=True,
+        short_circuit=False,
+        opt_level=1,
+        inline_budget=DEFAULT_INLINE_BUDGET,
+    ):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
-        self.__setup_ops()
+        self.quicken = quicken
+        self.short_circuit = short_circuit
+        if opt_level not in range(Interpreter.MAX_OPT_LEVEL + 1):
+            raise ValueError(f"Invalid optimization level {opt_level}")
+        self.pass_manager = PassManager(
+            opt_level,
+            Interpreter.PASSES,
+            {"short_circuit": short_circuit, "inline_budget": inline_budget},
+        )
 
     # run a program that's provided in a string
     # usese the provided Parser found in brewparse.py to parse the program
     # into an abstract syntax tree (ast)
     def run(self, program):
         ast = parse_program(program)
+        self.__check_call_arities(ast)
+        self.pass_manager.load(ast)
+        self.op_sites = []
+        self.member_sites = []
         self.__set_up_function_table(ast)
+        self.call_graph = CallGraph(ast)
         self.env = EnvironmentManager()
+        self.frame_base = None  # env depth of the running function's frame
+        # env depth of the running function's frame or inlined body's scope,
+        # where the variables it creates go (see escape_v4.py)
+        self.local_base = 0
         main_func = self.__get_func_by_name("main", 0)
         if main_func is None:
             super().error(ErrorType.NAME_ERROR, f"Function not found")
+        self.__compile(main_func.func_ast)
         self.__run_statements(main_func.func_ast.get("statements"))
 
+    # the table holds the function ASTs; a function's closure is only made when
+    # the function is first looked up, and its body only compiled when it is
+    # first run (see __compile)
     def __set_up_function_table(self, ast):
         self.func_name_to_ast = {}
-        empty_env = EnvironmentManager()
+        self.empty_env = EnvironmentManager()
         for func_def in ast.get("functions"):
             func_name = func_def.get("name")
             num_params = len(func_def.get("args"))
             if func_name not in self.func_name_to_ast:
                 self.func_name_to_ast[func_name] = {}
-            self.func_name_to_ast[func_name][num_params] = Closure(func_def, empty_env)
+            self.func_name_to_ast[func_name][num_params] = func_def
+            func_def.closure = None
+            func_def.compiled = False
+
+    # a top-level function has a single closure, as assigning a non-function to
+    # a variable holding it changes the function itself (see __assign)
+    def __closure_of(self, func_def):
+        if func_def.closure is None:
+            func_def.closure = Closure(func_def, self.empty_env)
+        return func_def.closure
+
+    # runs the AST passes over a top-level function, then readies its nodes
+    # (and those of the lambdas in it) for execution
+    def __compile(self, func_ast):
+        self.pass_manager.compile(func_ast)
+        self.__prepare_nodes(func_ast)
+        self.__link_call_sites(func_ast)
+        func_ast.compiled = True
+
+    # a call by name to a top-level function can only ever reach that function,
+    # as the function table takes precedence over variables, so one with no
+    # matching overload is rejected before the program starts (and before the
+    # passes, so that it does not depend on the code they remove)
+    def __check_call_arities(self, ast):
+        arities = {}
+        for func_def in ast.get("functions"):
+            arities.setdefault(func_def.get("name"), set()).add(len(func_def.get("args")))
+        stack = [ast]
+        while stack:
+            node = stack.pop()
+            if node.elem_type == InterpreterBase.FCALL_DEF:
+                func_name = node.get("name")
+                num_args = len(node.get("args"))
+                if func_name in arities and func_name not in BUILTIN_FUNCS:
+                    if num_args not in arities[func_name]:
+                        super().error(
+                            ErrorType.NAME_ERROR,
+                            f"Function {func_name} taking {num_args} params not found",
+                        )
+            stack.extend(children(node))
+
+    # binds each call by name to a top-level function to that function's
+    # closure, so that only calls of lambdas held in variables are looked up
+    # when they run
+    def __link_call_sites(self, ast):
+        stack = [ast]
+        while stack:
+            node = stack.pop()
+            if node.elem_type == InterpreterBase.FCALL_DEF:
+                node.target = None
+                func_name = node.get("name")
+                if func_name in self.func_name_to_ast and func_name not in BUILTIN_FUNCS:
+                    func_def = self.func_name_to_ast[func_name][len(node.get("args"))]
+                    node.target = self.__closure_of(func_def)
+            stack.extend(children(node))
+
+    # gives every operator node an OpSite that collects type feedback and
+    # every member read and method call a MemberSite (see icache_v4.py), and
+    # fills in the annotations the passes did not set (see infer_v4.py,
+    # resolve_v4.py, escape_v4.py, loops_v4.py and licm_v4.py)
+    def __prepare_nodes(self, ast):
+        stack = [ast]
+        while stack:
+            node = stack.pop()
+            kind = node.elem_type
+            if kind in Interpreter.BIN_OPS or kind in Interpreter.UNARY_OPS:
+                if self.quicken:
+                    node.site = OpSite(kind, unary=kind in Interpreter.UNARY_OPS)
+                    self.op_sites.append(node.site)
+                if not hasattr(node, "static_handler"):
+                    node.static_handler = None
+            elif kind in (Interpreter.IF_DEF, Interpreter.WHILE_DEF, BLOCK_DEF):
+                if not hasattr(node, "typed_condition"):
+                    node.typed_condition = False
+                if not hasattr(node, "scoped"):
+                    node.scoped = True
+                    node.else_scoped = True
+                if kind == Interpreter.WHILE_DEF:
+                    if not hasattr(node, "counted_loop"):
+                        node.counted_loop = None
+                    if not hasattr(node, "loop_invariants"):
+                        node.loop_invariants = None
+            elif kind == Interpreter.LAMBDA_DEF:
+                node.compiled = True
+                # the variables the lambda's body, or code it calls, may look up
+                # in its frame, where a call puts the captured ones
+                node.captures = self.call_graph.free_names(node)
+            elif kind in (Interpreter.VAR_DEF, "="):
+                node.member_site = None
+                if kind == Interpreter.VAR_DEF and "." in node.get("name") and self.quicken:
+                    node.member_site = MemberSite(node.get("name").split(".")[1])
+                    self.member_sites.append(node.member_site)
+                if not hasattr(node, "frame_local"):
+                    node.frame_local = False
+                if not hasattr(node, "slot"):
+                    node.slot = None
+                if not hasattr(node, "record"):
+                    node.record = None
+            elif kind in (InterpreterBase.FCALL_DEF, InterpreterBase.MCALL_DEF, INLINED_DEF):
+                node.member_site = None
+                if kind == InterpreterBase.MCALL_DEF and self.quicken:
+                    node.member_site = MemberSite(node.get("name"))
+                    self.member_sites.append(node.member_site)
+                if not hasattr(node, "owned_args"):
+                    node.owned_args = [False] * len(node.get("args"))
+            elif kind == InterpreterBase.RETURN_DEF:
+                if not hasattr(node, "owned"):
+                    node.owned = False
+                if not hasattr(node, "local"):
+                    node.local = None
+            stack.extend(reversed(list(children(node))))
+
+    # per-site quickening statistics for the last program run
+    def get_op_site_stats(self):
+        return [site.stats() for site in self.op_sites]
+
+    # scope dicts made and recycled by the last program run (see env_v4.py)
+    def get_allocation_stats(self):
+        return {
+            "scopes allocated": self.env.scopes_allocated,
+            "scopes reused": self.env.scopes_reused,
+        }
+
+    # per-site member inline cache statistics for the last program run
+    def get_member_site_stats(self):
+        return [site.stats() for site in self.member_sites]
+
+    # (pass name, seconds) for each AST pass of the last program run
+    def get_pass_timings(self):
+        return list(self.pass_manager.timings.items())
 
     def __get_func_by_name(self, name, num_params):
         if name not in self.func_name_to_ast:
@@ -74,43 +294,52 @@ class Interpreter(InterpreterBase):
                     f"Function {name} has multiple overloaded versions",
                 )
             num_args = next(iter(candidate_funcs))
-            closure = candidate_funcs[num_args]
-            return closure
+            return self.__closure_of(candidate_funcs[num_args])
 
         if num_params not in candidate_funcs:
             super().error(
                 ErrorType.NAME_ERROR,
                 f"Function {name} taking {num_params} params not found",
             )
-        return candidate_funcs[num_params]
-
-    def __run_statements(self, statements):
-        self.env.push()
+        return self.__closure_of(candidate_funcs[num_params])
+
+    # runs the statements in a new scope, which starts out as the given dict, or
+    # in the current scope if they need no scope of their own (unscoped blocks,
+    # see ScopeElisionPass in resolve_v4.py)
+    def __run_statements(self, statements, scope=None, scoped=True):
+        if scoped:
+            self.env.push(scope)
         for statement in statements:
             if self.trace_output:
                 print(statement)
-            status = ExecStatus.CONTINUE
+            result = Interpreter.CONTINUE_RESULT
             if statement.elem_type == InterpreterBase.FCALL_DEF:
-                self.__call_func(statement)
+                self.__call(statement)
             elif statement.elem_type == InterpreterBase.MCALL_DEF:
-                self.__call_method(statement)
+                self.__call(statement)
             elif statement.elem_type == "=":
                 self.__assign(statement)
             elif statement.elem_type == InterpreterBase.RETURN_DEF:
-                status, return_val = self.__do_return(statement)
+                result = self.__do_return(statement)
             elif statement.elem_type == Interpreter.IF_DEF:
-                status, return_val = self.__do_if(statement)
+                result = self.__do_if(statement)
             elif statement.elem_type == Interpreter.WHILE_DEF:
-                status, return_val = self.__do_while(statement)
-
-            if status == ExecStatus.RETURN:
-                self.env.pop()
-                return (status, return_val)
+                result = self.__do_while(statement)
+            elif statement.elem_type == INLINED_DEF:
+                self.__run_inlined(statement)
+            elif statement.elem_type == BLOCK_DEF:
+                result = self.__run_statements(statement.get("statements"), None, statement.scoped)
+
+            if result[0] != ExecStatus.CONTINUE:
+                break
+        else:
+            result = Interpreter.CONTINUE_RESULT
 
-        self.env.pop()
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+        if scoped:
+            self.env.pop()
+        return result
 
-    def __call_method(self, method_ast):
+    def __resolve_method(self, method_ast):
         obj_name = method_ast.get("objref")
         method_name = method_ast.get("name")
         target_obj = self.env.get(obj_name)
@@ -119,44 +348,92 @@ class Interpreter(InterpreterBase):
         if target_obj.type() != Type.OBJECT:
             super().error(ErrorType.TYPE_ERROR, f"{obj_name} is not an object")
 
-        member_var = target_obj.value().get_member(method_name)
+        if method_ast.member_site is not None:
+            member_var = method_ast.member_site.lookup(target_obj.v)
+        else:
+            member_var = target_obj.value().get_member(method_name)
         if member_var.type() == Type.NIL:
             super().error(ErrorType.NAME_ERROR, f"Method {obj_name}.{method_name} not found")
         if member_var.type() != Type.CLOSURE:
             super().error(ErrorType.TYPE_ERROR, f"Trying to call non-function/closure")
-        target_ast = member_var.value().func_ast
 
-        new_env = {}
+        new_env = self.env.new_scope()
         new_env[InterpreterBase.THIS_DEF] = self.env.get(obj_name)
-        self.__prepare_env_with_closed_variables(member_var.value(), new_env)
-        self.__prepare_params(target_ast,method_ast, new_env)
-        self.env.push(new_env)
-        _, return_val = self.__run_statements(target_ast.get("statements"))
-        self.env.pop()
+        return member_var.value(), new_env
+
+    # runs a function or method call (an fcall or mcall node), whose callee
+    # __do_tail_call may have resolved already.  The body runs in its own frame;
+    # tail calls made by the body replace that frame instead of nesting a new
+    # one on top of it.  Everything happens in this one Python frame, so that a
+    # Brewin call costs as little of Python's recursion limit as it can
+    def __call(self, call_ast, resolved=None):
+        if resolved is None:
+            if call_ast.elem_type == InterpreterBase.MCALL_DEF:
+                resolved = self.__resolve_method(call_ast)
+            elif call_ast.get("name") == "print":
+                return self.__call_print(call_ast)
+            elif call_ast.get("name") == "inputi":
+                return self.__call_input(call_ast)
+            else:
+                resolved = self.__resolve_func(call_ast)
+        target_closure, new_env = resolved
+        target_ast = target_closure.func_ast
+        self.__prepare_env_with_closed_variables(target_closure, new_env)
+        self.__prepare_params(target_ast, call_ast, new_env)
+        if not target_ast.compiled:
+            self.__compile(target_ast)
+        caller_base, caller_local_base = self.frame_base, self.local_base
+        self.frame_base = self.local_base = self.env.depth()
+        # the body's scope and the frame go away together, so the body runs
+        # right in the frame
+        status, return_val = self.__run_statements(target_ast.get("statements"), new_env)
+        tail_called = False
+        while status == ExecStatus.TAIL_CALL:
+            tail_called = True
+            target_ast, new_env = return_val
+            if not target_ast.compiled:
+                self.__compile(target_ast)
+            status, return_val = self.__run_statements(target_ast.get("statements"), new_env)
+        self.frame_base, self.local_base = caller_base, caller_local_base
+        if tail_called and status != ExecStatus.RETURN:
+            # the eliminated return statements would have copied the nil result
+            return_val = copy_value(return_val)
         return return_val
 
-    def __call_func(self, call_ast):
+    def __resolve_func(self, call_ast):
         func_name = call_ast.get("name")
-        if func_name == "print":
-            return self.__call_print(call_ast)
-        if func_name == "inputi":
-            return self.__call_input(call_ast)
-
-        actual_args = call_ast.get("args")
-        target_closure = self.__get_func_by_name(func_name, len(actual_args))
+        target_closure = call_ast.target
+        if target_closure is None:
+            target_closure = self.__get_func_by_name(func_name, len(call_ast.get("args")))
         if target_closure == None:
             super().error(ErrorType.NAME_ERROR, f"Function {func_name} not found")
         if target_closure.type != Type.CLOSURE:
             super().error(ErrorType.TYPE_ERROR, f"Function {func_name} is changed to non-function type.")
-        target_ast = target_closure.func_ast
+        return target_closure, self.env.new_scope()
+
+    # for `return f(...)` / `return o.m(...)`: resolves the callee and, if the
+    # caller's frame cannot be observed by it, prepares the callee's frame so that
+    # __call can run it in place of the caller's; otherwise makes the call as
+    # any other, at the same depth
+    def __do_tail_call(self, call_ast):
+        if call_ast.elem_type == InterpreterBase.MCALL_DEF:
+            target_closure, new_env = self.__resolve_method(call_ast)
+        elif call_ast.get("name") in BUILTIN_FUNCS:
+            return (ExecStatus.RETURN, copy_value(self.__call(call_ast)))
+        else:
+            target_closure, new_env = self.__resolve_func(call_ast)
+
+        free_names = self.call_graph.free_names(
+            target_closure.func_ast, InterpreterBase.THIS_DEF in new_env
+        )
+        for symbol in self.env.symbols_since(self.frame_base):
+            if symbol in free_names:
+                return_val = self.__call(call_ast, (target_closure, new_env))
+                return (ExecStatus.RETURN, copy_value(return_val))
 
-        new_env = {}
         self.__prepare_env_with_closed_variables(target_closure, new_env)
-        self.__prepare_params(target_ast,call_ast, new_env)
-        self.env.push(new_env)
-        _, return_val = self.__run_statements(target_ast.get("statements"))
-        self.env.pop()
-        return return_val
+        self.__prepare_params(target_closure.func_ast, call_ast, new_env)
+        return (ExecStatus.TAIL_CALL, (target_closure.func_ast, new_env))
 
     def __prepare_env_with_closed_variables(self, target_closure, temp_env):
         for var_name, value in target_closure.captured_env:
@@ -176,19 +453,46 @@ class Interpreter(InterpreterBase):
                 f"Function {target_ast.get('name')} with {len(actual_args)} args not found",
             )
 
-        for formal_ast, actual_ast in zip(formal_args, actual_args):
-            if formal_ast.elem_type == InterpreterBase.REFARG_DEF:
-                result = self.__eval_expr(actual_ast)
-            else:
-                result = copy.deepcopy(self.__eval_expr(actual_ast))
+        owned_args = call_ast.owned_args
+        for i, (formal_ast, actual_ast) in enumerate(zip(formal_args, actual_args)):
+            result = self.__eval_expr(actual_ast)
+            if formal_ast.elem_type != InterpreterBase.REFARG_DEF:
+                result = self.__pass_value(result, owned_args[i])
             arg_name = formal_ast.get("name")
             temp_env[arg_name] = result
 
+    # the Value an argument or return value gets: the evaluated Value itself if
+    # nothing else can refer to it (see escape_v4.py), otherwise a copy
+    def __pass_value(self, value, owned):
+        if owned and value is not Interpreter.NIL_VALUE:
+            return value
+        return copy_value(value)
+
+    # a call whose body the inliner substituted in (see inline_v4.py)
+    def __run_inlined(self, inlined_ast):
+        new_env = self.env.new_scope()
+        owned_args = inlined_ast.owned_args
+        formals_and_args = zip(inlined_ast.get("formals"), inlined_ast.get("args"))
+        for i, (formal_ast, actual_ast) in enumerate(formals_and_args):
+            result = self.__eval_expr(actual_ast)
+            if formal_ast.elem_type != InterpreterBase.REFARG_DEF:
+                result = self.__pass_value(result, owned_args[i])
+            new_env[formal_ast.get("name")] = result
+        # the body's return statements end the inlined body, not the caller
+        caller_base, caller_local_base = self.frame_base, self.local_base
+        self.frame_base = None
+        self.local_base = self.env.depth()
+        status, return_val = self.__run_statements(inlined_ast.get("statements"), new_env)
+        self.frame_base, self.local_base = caller_base, caller_local_base
+        if status == ExecStatus.RETURN:
+            return return_val
+        return Interpreter.NIL_VALUE
+
     def __call_print(self, call_ast):
         output = ""
         for arg in call_ast.get("args"):
-            result = self.__eval_expr(arg)  # result is a Value object
-            if result.type()==Type.NIL:
+            result = self.__eval_value(arg)
+            if result is None:
                 super().error(ErrorType.NAME_ERROR, "Value doesn't exist")
             output = output + get_printable(result)
         super().output(output)
@@ -210,13 +514,22 @@ class Interpreter(InterpreterBase):
             return Value(Type.STRING, inp)
 
     def __assign(self, assign_ast):
+        if assign_ast.record is not None and self.__new_record(assign_ast.record):
+            return
         parsed_left = (assign_ast.get("name")).split('.')
         var_name = parsed_left[0]
         has_member = True if len(parsed_left)>1 else False
         if has_member: member = parsed_left[1]
 
-        src_value_obj = copy.copy(self.__eval_expr(assign_ast.get("expression")))
-        target_value_obj = self.env.get(var_name)
+        src_value_obj = self.__eval_value(assign_ast.get("expression"))
+        if isinstance(src_value_obj, Value):
+            src_value_obj = copy.copy(src_value_obj)
+        else:
+            src_value_obj = box(src_value_obj)
+        if assign_ast.frame_local:
+            target_value_obj = self.env.get_at(self.frame_base, var_name)
+        else:
+            target_value_obj = self.env.get(var_name)
         if target_value_obj is None:
             if has_member: 
                 super().error(
@@ -232,17 +545,37 @@ class Interpreter(InterpreterBase):
                     if member == "proto" and src_value_obj.type() not in [Type.OBJECT, Type.NIL]:
                         super().error(ErrorType.TYPE_ERROR, "Assigned proto is not an object")
                     if src_value_obj.type() == Type.OBJECT: #if right side is an object, use direct object
-                        setattr(target_value_obj.v, member, self.__eval_expr(assign_ast.get("expression")))
+                        src_value_obj = self.__eval_expr(assign_ast.get("expression"))
+                    #if right side is not an object, use copy
+                    if assign_ast.slot is not None and type(target_value_obj.v) is list:
+                        target_value_obj.v[assign_ast.slot] = src_value_obj
                     else:
-                        setattr(target_value_obj.v, member, src_value_obj) #if right side is not an object, use copy
+                        write_barrier()
+                        src_value_obj.heap = True
+                        target_value_obj.v.set_member(member, src_value_obj)
                             # if a closure is changed to another type such as int, we cannot make function calls on it any more 
                 else:
                     super().error(ErrorType.TYPE_ERROR, f"Dot operator used on non-object {var_name}")
             else:
                 if target_value_obj.t == Type.CLOSURE and src_value_obj.t != Type.CLOSURE:
+                    write_barrier()
                     target_value_obj.v.type = src_value_obj.t
                 target_value_obj.set(src_value_obj)
 
+    # `v = @` for a variable whose object the escape analysis replaced by a list
+    # of member slots (see escape_v4.py); False if v is a caller's variable,
+    # which gets a real object
+    def __new_record(self, record):
+        value_obj = self.env.get_since(self.local_base, record.name)
+        if value_obj is None and self.env.get(record.name) is not None:
+            return False
+        slots = Value(Type.OBJECT, [None] * record.size)
+        if value_obj is None:
+            self.env.set(record.name, slots)
+        else:
+            value_obj.set(slots)
+        return True
+
     def __eval_expr(self, expr_ast):
         if expr_ast.elem_type == InterpreterBase.NIL_DEF:
             return Interpreter.NIL_VALUE
@@ -256,27 +589,78 @@ class Interpreter(InterpreterBase):
             return Value(Type.OBJECT, Object())
         if expr_ast.elem_type == InterpreterBase.VAR_DEF:
             return self.__eval_name(expr_ast)
+        if expr_ast.elem_type == CSE_DEF:
+            cse_value = self.__eval_expr(expr_ast.get("expression"))
+            expr_ast.value = cse_value
+            return cse_value
+        if expr_ast.elem_type == CSE_USE:
+            cse_value = expr_ast.definition.value
+            if expr_ast.copy_result:
+                return Value(cse_value.t, cse_value.v)
+            return cse_value
+        if expr_ast.elem_type == INVARIANT_DEF:
+            return box(self.__eval_invariant(expr_ast))
+        if expr_ast.elem_type == INDUCTION_MUL_DEF:
+            return box(self.__eval_induction_mul(expr_ast))
         if expr_ast.elem_type == InterpreterBase.FCALL_DEF:
-            return self.__call_func(expr_ast)
+            return self.__call(expr_ast)
+        if expr_ast.elem_type == INLINED_DEF:
+            return self.__run_inlined(expr_ast)
         if expr_ast.elem_type == InterpreterBase.MCALL_DEF:
-            return self.__call_method(expr_ast)
+            return self.__call(expr_ast)
         if expr_ast.elem_type in Interpreter.BIN_OPS:
-            return self.__eval_op(expr_ast)
-        if expr_ast.elem_type == Interpreter.NEG_DEF:
-            return self.__eval_unary(expr_ast, Type.INT, lambda x: -1 * x)
-        if expr_ast.elem_type == Interpreter.NOT_DEF:
-            return self.__eval_unary(expr_ast, Type.BOOL, lambda x: not x)
+            return box(self.__eval_op(expr_ast))
+        if expr_ast.elem_type in Interpreter.UNARY_OPS:
+            return box(self.__eval_unary(expr_ast))
         if expr_ast.elem_type == Interpreter.LAMBDA_DEF:
-            return Value(Type.CLOSURE, Closure(expr_ast, self.env))
+            return Value(Type.CLOSURE, Closure(expr_ast, self.env, expr_ast.captures))
+
+    # evaluates an expression to its unboxed value (see type_valuev4.unbox), for
+    # the operators, conditions and assignments that only need the value.  Calls
+    # are made from here rather than through __eval_expr, so that an operand
+    # that is a call costs no more Python frames than it would boxed
+    def __eval_value(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.VAR_DEF:
+            return unbox(self.__eval_name(expr_ast))
+        if kind in Interpreter.BIN_OPS:
+            return self.__eval_op(expr_ast)
+        if kind in Interpreter.RAW_LITERALS:
+            return expr_ast.get("val")
+        if kind in Interpreter.UNARY_OPS:
+            return self.__eval_unary(expr_ast)
+        if kind in Interpreter.CALL_DEFS:
+            return unbox(self.__call(expr_ast))
+        if kind == INLINED_DEF:
+            return unbox(self.__run_inlined(expr_ast))
+        if kind == CSE_USE:
+            return unbox(expr_ast.definition.value)
+        if kind == INVARIANT_DEF:
+            return self.__eval_invariant(expr_ast)
+        if kind == INDUCTION_MUL_DEF:
+            return self.__eval_induction_mul(expr_ast)
+        if kind == InterpreterBase.NIL_DEF:
+            return None
+        return unbox(self.__eval_expr(expr_ast))
 
     def __eval_name(self, name_ast):
         #if has a dot in the name_ast.get("name"), then call the obj's attribute and get that member variable
+        if name_ast.slot is not None:
+            val = self.env.get(name_ast.record.name)
+            if val is not None and type(val.v) is list:
+                member_val = val.v[name_ast.slot]
+                return member_val if member_val is not None else Value(Type.NIL, None)
         parsed_name = name_ast.get("name").split('.')
         var_name = parsed_name[0]
-        val = self.env.get(var_name)
+        if name_ast.frame_local:
+            val = self.env.get_at(self.frame_base, var_name)
+        else:
+            val = self.env.get(var_name)
         if val is not None:
             if len(parsed_name)>1:
                 if val.type() == Type.OBJECT :
+                    if name_ast.member_site is not None:
+                        return name_ast.member_site.lookup(val.v)
                     return val.value().get_member(parsed_name[1])
                 else:
                     super().error(ErrorType.TYPE_ERROR, f"Dot operator used on non-object {var_name}")
@@ -290,213 +674,156 @@ class Interpreter(InterpreterBase):
 
     
 
+    # loop-invariant expression (see licm_v4.py): computed once per loop entry;
+    # its value is a primitive, which is never None
+    def __eval_invariant(self, memo_ast):
+        if not memo_ast.enabled:
+            return self.__eval_value(memo_ast.get("expression"))
+        if memo_ast.cached is None:
+            memo_ast.cached = self.__eval_value(memo_ast.get("expression"))
+        return memo_ast.cached
+
+    # var * factor, derived from the previous product when var moved by its step
+    def __eval_induction_mul(self, mul_ast):
+        index = self.env.get(mul_ast.get("var"))
+        if index is None or index.t != Type.INT:
+            return self.__eval_value(mul_ast.get("expression"))
+        step = mul_ast.get("step")
+        if mul_ast.last_index is not None and index.v - mul_ast.last_index == step:
+            product = mul_ast.last_product + step * mul_ast.get("factor")
+        else:
+            product = index.v * mul_ast.get("factor")
+        mul_ast.last_index = index.v
+        mul_ast.last_product = product
+        return product
+
+    # operators take and return unboxed values.  A variable (or member) operand
+    # is unboxed only once the other operand ran, which may assign it
     def __eval_op(self, arith_ast):
+        if self.short_circuit and arith_ast.elem_type in Interpreter.LOGICAL_OPS:
+            return self.__eval_short_circuit(arith_ast)
+        left_ast = arith_ast.get("op1")
+        if left_ast.elem_type in Interpreter.CELL_KINDS:
+            left = self.__eval_expr(left_ast)
+            right = self.__eval_value(arith_ast.get("op2"))
+            left = unbox(left)
+        else:
+            left = self.__eval_value(left_ast)
+            right = self.__eval_value(arith_ast.get("op2"))
+        if arith_ast.static_handler is not None:
+            return arith_ast.static_handler(left, right)
+        return self.__apply_op(arith_ast, left, right)
+
+    # an int/bool left operand decides false && ... and true || ... on its own;
+    # anything else falls through to the regular (type checked) evaluation
+    def __eval_short_circuit(self, arith_ast):
         left_value_obj = self.__eval_expr(arith_ast.get("op1"))
-        right_value_obj = self.__eval_expr(arith_ast.get("op2"))
-
-
-        left_value_obj, right_value_obj = self.__bin_op_promotion(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        )
-
-        if not self.__compatible_types(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        ):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible types for {arith_ast.elem_type} operation",
-            )
-        if arith_ast.elem_type not in self.op_to_lambda[left_value_obj.type()]:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible operator {arith_ast.elem_type} for type {left_value_obj.type()}",
-            )
-        f = self.op_to_lambda[left_value_obj.type()][arith_ast.elem_type]
-        return f(left_value_obj, right_value_obj)
-
-    # bool and int, int and bool for and/or/==/!= -> coerce int to bool
-    # bool and int, int and bool for arithmetic ops, coerce true to 1, false to 0
-    def __bin_op_promotion(self, operation, op1, op2):
-        if operation in self.op_to_lambda[Type.BOOL]:  # && or ||
-            
-            # If this operation is still allowed in the ints, then continue
-            if operation in self.op_to_lambda[Type.INT] and op1.type() == Type.INT \
-                and op2.type() == Type.INT:
-                pass
-            else:
-                if op1.type() == Type.INT:
-                    op1 = Interpreter.__int_to_bool(op1)
-                if op2.type() == Type.INT:
-                    op2 = Interpreter.__int_to_bool(op2)
-        if operation in self.op_to_lambda[Type.INT]:  # +, -, *, /
-            if op1.type() == Type.BOOL:
-                op1 = Interpreter.__bool_to_int(op1)
-            if op2.type() == Type.BOOL:
-                op2 = Interpreter.__bool_to_int(op2)
-        return (op1, op2)
-
-    def __unary_op_promotion(self, operation, op1):
-        if operation == "!" and op1.type() == Type.INT:
-            op1 = Interpreter.__int_to_bool(op1)
-        return op1
-
-    @staticmethod
-    def __int_to_bool(value):
-        return Value(Type.BOOL, value.value() != 0)
-
-    @staticmethod
-    def __bool_to_int(value):
-        return Value(Type.INT, 1 if value.value() else 0)
-
-    def __compatible_types(self, oper, obj1, obj2):
-        # DOCUMENT: allow comparisons ==/!= of anything against anything
-        if oper in ["==", "!="]:
-            return True
-        return obj1.type() == obj2.type()
-
-    def __eval_unary(self, arith_ast, t, f):
-        value_obj = self.__eval_expr(arith_ast.get("op1"))
-        value_obj = self.__unary_op_promotion(arith_ast.elem_type, value_obj)
-
-        if value_obj.type() != t:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible type for {arith_ast.elem_type} operation",
-            )
-        return Value(t, f(value_obj.value()))
-
-    def __setup_ops(self):
-        self.op_to_lambda = {}
-        # set up operations on integers
-        self.op_to_lambda[Type.INT] = {}
-        self.op_to_lambda[Type.INT]["+"] = lambda x, y: Value(
-            x.type(), x.value() + y.value()
-        )
-        self.op_to_lambda[Type.INT]["-"] = lambda x, y: Value(
-            x.type(), x.value() - y.value()
-        )
-        self.op_to_lambda[Type.INT]["*"] = lambda x, y: Value(
-            x.type(), x.value() * y.value()
-        )
-        self.op_to_lambda[Type.INT]["/"] = lambda x, y: Value(
-            x.type(), x.value() // y.value()
-        )
-        self.op_to_lambda[Type.INT]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
-        )
-        self.op_to_lambda[Type.INT]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
-        )
-        self.op_to_lambda[Type.INT]["<"] = lambda x, y: Value(
-            Type.BOOL, x.value() < y.value()
-        )
-        self.op_to_lambda[Type.INT]["<="] = lambda x, y: Value(
-            Type.BOOL, x.value() <= y.value()
-        )
-        self.op_to_lambda[Type.INT][">"] = lambda x, y: Value(
-            Type.BOOL, x.value() > y.value()
-        )
-        self.op_to_lambda[Type.INT][">="] = lambda x, y: Value(
-            Type.BOOL, x.value() >= y.value()
-        )
-        #  set up operations on strings
-        self.op_to_lambda[Type.STRING] = {}
-        self.op_to_lambda[Type.STRING]["+"] = lambda x, y: Value(
-            x.type(), x.value() + y.value()
-        )
-        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
-        )
-        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
-        )
-        #  set up operations on bools
-        self.op_to_lambda[Type.BOOL] = {}
-        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: Value(
-            x.type(), x.value() and y.value()
-        )
-        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: Value(
-            x.type(), x.value() or y.value()
-        )
-        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
-        )
-        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
-        )
-
-        #  set up operations on nil
-        self.op_to_lambda[Type.NIL] = {}
-        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
-        )
-        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
-        )
-
-        #  set up operations on closures
-        self.op_to_lambda[Type.CLOSURE] = {}
-        self.op_to_lambda[Type.CLOSURE]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
-        )
-        self.op_to_lambda[Type.CLOSURE]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
-        )
-
-        #  set up operations on objects
-        self.op_to_lambda[Type.OBJECT] = {}
-        self.op_to_lambda[Type.OBJECT]["=="] = lambda x, y: Value(
-            Type.BOOL, x is y
-        )
-        self.op_to_lambda[Type.OBJECT]["!="] = lambda x, y: Value(
-            Type.BOOL, x is not y
-        )
+        left = unbox(left_value_obj)
+        decisive = arith_ast.elem_type == "||"
+        if type(left) is bool and left == decisive:
+            return decisive
+        if type(left) is int and (left != 0) == decisive:
+            return decisive
+        right = self.__eval_value(arith_ast.get("op2"))
+        return self.__apply_op(arith_ast, unbox(left_value_obj), right)
+
+    def __apply_op(self, arith_ast, left, right):
+        # the Value of an object or closure is its own unboxed value
+        left_type = RAW_TYPES.get(type(left)) or left.t
+        right_type = RAW_TYPES.get(type(right)) or right.t
+        if self.quicken:
+            site = arith_ast.site
+            if (
+                site.handler is not None
+                and left_type is site.left_type
+                and right_type is site.right_type
+            ):
+                site.hits += 1
+                return site.handler(left, right)
+            site.record(left_type, right_type)
+        # same as dispatch_index(), inlined as this is the hottest path
+        entry = DISPATCH[
+            (OP_IDS[arith_ast.elem_type] * TYPE_SLOTS + left_type._value_) * TYPE_SLOTS
+            + right_type._value_
+        ]
+        if entry.error is not None:
+            super().error(*entry.error)
+        return entry.raw(left, right)
+
+    def __eval_unary(self, arith_ast):
+        operand = self.__eval_value(arith_ast.get("op1"))
+        if arith_ast.static_handler is not None:
+            return arith_ast.static_handler(operand)
+        operand_type = RAW_TYPES.get(type(operand)) or operand.t
+        if self.quicken:
+            site = arith_ast.site
+            if site.handler is not None and operand_type is site.left_type:
+                site.hits += 1
+                return site.handler(operand)
+            site.record(operand_type)
+        entry = DISPATCH[dispatch_index(OP_IDS[arith_ast.elem_type], operand_type)]
+        if entry.error is not None:
+            super().error(*entry.error)
+        return entry.raw(operand)
 
     def __do_if(self, if_ast):
         cond_ast = if_ast.get("condition")
-        result = self.__eval_expr(cond_ast)
-        if result.type() == Type.INT:
-            result = Interpreter.__int_to_bool(result)
-        if result.type() != Type.BOOL:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                "Incompatible type for if condition",
-            )
-        if result.value():
+        result = self.__eval_value(cond_ast)
+        if not if_ast.typed_condition:
+            if type(result) is int:
+                result = result != 0
+            if type(result) is not bool:
+                super().error(
+                    ErrorType.TYPE_ERROR,
+                    "Incompatible type for if condition",
+                )
+        if result:
             statements = if_ast.get("statements")
-            status, return_val = self.__run_statements(statements)
-            return (status, return_val)
+            return self.__run_statements(statements, None, if_ast.scoped)
         else:
             else_statements = if_ast.get("else_statements")
             if else_statements is not None:
-                status, return_val = self.__run_statements(else_statements)
-                return (status, return_val)
+                return self.__run_statements(else_statements, None, if_ast.else_scoped)
 
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+        return Interpreter.CONTINUE_RESULT
 
     def __do_while(self, while_ast):
+        counted_loop = while_ast.counted_loop
+        if counted_loop is not None and not self.trace_output:
+            if counted_loop.run(self.env):
+                return Interpreter.CONTINUE_RESULT
+        loop_invariants = while_ast.loop_invariants
+        if loop_invariants is not None:
+            loop_invariants.enter(self.env)
         cond_ast = while_ast.get("condition")
-        run_while = Interpreter.TRUE_VALUE
-        while run_while.value():
-            run_while = self.__eval_expr(cond_ast)
-            if run_while.type() == Type.INT:
-                run_while = Interpreter.__int_to_bool(run_while)
-            if run_while.type() != Type.BOOL:
-                super().error(
-                    ErrorType.TYPE_ERROR,
-                    "Incompatible type for while condition",
-                )
-            if run_while.value():
+        run_while = True
+        while run_while:
+            run_while = self.__eval_value(cond_ast)
+            if not while_ast.typed_condition:
+                if type(run_while) is int:
+                    run_while = run_while != 0
+                if type(run_while) is not bool:
+                    super().error(
+                        ErrorType.TYPE_ERROR,
+                        "Incompatible type for while condition",
+                    )
+            if run_while:
                 statements = while_ast.get("statements")
-                status, return_val = self.__run_statements(statements)
-                if status == ExecStatus.RETURN:
-                    return status, return_val
+                result = self.__run_statements(statements, None, while_ast.scoped)
+                if result[0] != ExecStatus.CONTINUE:
+                    return result
 
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+        return Interpreter.CONTINUE_RESULT
 
     def __do_return(self, return_ast):
         expr_ast = return_ast.get("expression")
         if expr_ast is None:
-            return (ExecStatus.RETURN, Interpreter.NIL_VALUE)
-        value_obj = copy.deepcopy(self.__eval_expr(expr_ast))
-        return (ExecStatus.RETURN, value_obj)
+            return Interpreter.RETURN_NIL_RESULT
+        if self.frame_base is not None and expr_ast.elem_type in Interpreter.CALL_DEFS:
+            return self.__do_tail_call(expr_ast)
+        value_obj = self.__eval_expr(expr_ast)
+        if return_ast.local is not None:
+            # the function's own variable, which nothing else refers to
+            if self.env.get_since(self.local_base, return_ast.local) is value_obj:
+                return (ExecStatus.RETURN, value_obj)
+        return (ExecStatus.RETURN, self.__pass_value(value_obj, return_ast.owned))
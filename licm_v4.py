@@ -0,0 +1,261 @@
+from analysis_v4 import BUILTIN_FUNCS
+from element import Element
+from intbase import InterpreterBase
+from loops_v4 import induction_step
+from ops_v4 import BINARY_OPS, UNARY_OPS
+from passes_v4 import INDUCTION_MUL_DEF, INLINED_DEF, INVARIANT_DEF, Pass
+from type_valuev4 import Type
+
+# Loop-invariant code motion and strength reduction.
+#
+# Brewin has no temporaries to hoist an invariant expression into (and any
+# variable the pass made up would be visible to callees, as scoping is
+# dynamic), so invariant expressions are instead wrapped in invariant nodes:
+# the interpreter evaluates such a node the first time it is reached after
+# entering its loop and reuses the result for the rest of that loop run.
+#
+# An expression is invariant if it is made of operators, literals and plain
+# variables that the loop never assigns.  That only holds if nothing else can
+# assign them either, so loops that call anything but print/inputi are left
+# alone, and LoopInvariants.enter() checks at runtime that no variable the loop
+# assigns is an alias (a ref parameter, or a shared object cell) of a variable
+# the invariants read.  Lambda bodies are never rewritten, as they may run
+# after the loop is done.
+#
+# Strength reduction replaces `i * k` by an induction_mul node when i is the
+# loop's induction variable (stepped by a constant) and k an int literal: as
+# long as i moves by its step, the next product is the previous one plus
+# step * k.
+
+PRIMITIVE_TYPES = (Type.INT, Type.STRING, Type.BOOL)
+
+
+def _is_plain_var(node):
+    return node.elem_type == InterpreterBase.VAR_DEF and "." not in node.get("name")
+
+
+# yields the nodes a loop runs when it is interpreted (not those of lambdas it
+# creates)
+def loop_nodes(while_ast):
+    stack = [while_ast.get("condition")] + list(while_ast.get("statements"))
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.elem_type == InterpreterBase.LAMBDA_DEF:
+            continue
+        for value in node.dict.values():
+            if isinstance(value, Element):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(item for item in value if isinstance(item, Element))
+
+
+# variables the loop assigns (or binds as inlined parameters), or None if it
+# may call code that assigns others
+def assigned_names(while_ast):
+    names = set()
+    for node in loop_nodes(while_ast):
+        kind = node.elem_type
+        if kind == "=":
+            names.add(node.get("name").split(".")[0])
+        elif kind == INLINED_DEF:
+            names |= {formal.get("name") for formal in node.get("formals")}
+        elif kind == InterpreterBase.MCALL_DEF:
+            return None
+        elif kind == InterpreterBase.FCALL_DEF and node.get("name") not in BUILTIN_FUNCS:
+            return None
+    return names
+
+
+class LoopInvariants:
+    def __init__(self, memos, read, assigned):
+        self.memos = memos  # the loop's invariant nodes
+        self.read = read  # variables the invariant nodes read
+        self.assigned = assigned  # variables the loop assigns
+
+    # called on every entry to the loop: forgets the previous run's results, and
+    # turns memoization off for this run if an assignment could change them
+    def enter(self, env):
+        enabled = True
+        read_cells = set()
+        for name in self.read:
+            value = env.get(name)
+            if value is None or value.t not in PRIMITIVE_TYPES:
+                enabled = False
+                break
+            read_cells.add(id(value))
+        if enabled:
+            for name in self.assigned:
+                value = env.get(name)
+                if value is not None and id(value) in read_cells:
+                    enabled = False
+                    break
+        for memo in self.memos:
+            memo.cached = None
+            memo.enabled = enabled
+
+
+class LoopInvariantPass(Pass):
+    name = "loop-invariants"
+    level = 2
+    requires = ("constant-folding",)
+
+    def run(self, program_ast):
+        self.__visit(program_ast)
+        return program_ast
+
+    # outer loops go first, so an expression moves to the outermost loop it is
+    # invariant in
+    def __visit(self, node):
+        if node.elem_type == InterpreterBase.WHILE_DEF:
+            self.__hoist_loop(node)
+        for value in node.dict.values():
+            items = value if isinstance(value, list) else [value]
+            for item in items:
+                if isinstance(item, Element):
+                    self.__visit(item)
+
+    def __hoist_loop(self, while_ast):
+        assigned = assigned_names(while_ast)
+        if assigned is None:
+            return
+        memos = []
+        self.__rewrite(while_ast, assigned, memos)
+        if not memos:
+            return
+        read = set()
+        for memo in memos:
+            read |= _read_names(memo.get("expression"))
+        while_ast.loop_invariants = LoopInvariants(memos, read, assigned)
+
+    # wraps the largest invariant operator expressions among the node's
+    # descendants
+    def __rewrite(self, node, assigned, memos):
+        for key, value in node.dict.items():
+            if isinstance(value, Element):
+                node.dict[key] = self.__rewrite_child(value, assigned, memos)
+            elif isinstance(value, list):
+                node.dict[key] = [
+                    self.__rewrite_child(item, assigned, memos)
+                    if isinstance(item, Element)
+                    else item
+                    for item in value
+                ]
+
+    def __rewrite_child(self, node, assigned, memos):
+        kind = node.elem_type
+        if kind in (InterpreterBase.LAMBDA_DEF, INVARIANT_DEF):
+            return node
+        if (kind in BINARY_OPS or kind in UNARY_OPS) and _invariant(node, assigned):
+            if not _read_names(node):
+                return node  # only literals: an error that folding left in place
+            memo = Element(INVARIANT_DEF, expression=node)
+            memo.cached = None
+            memo.enabled = False
+            memos.append(memo)
+            return memo
+        self.__rewrite(node, assigned, memos)
+        return node
+
+
+def _invariant(node, assigned):
+    kind = node.elem_type
+    if kind in (
+        InterpreterBase.INT_DEF,
+        InterpreterBase.STRING_DEF,
+        InterpreterBase.BOOL_DEF,
+        InterpreterBase.NIL_DEF,
+        INVARIANT_DEF,
+    ):
+        return True
+    if kind == InterpreterBase.VAR_DEF:
+        return _is_plain_var(node) and node.get("name") not in assigned
+    if kind in UNARY_OPS:
+        return _invariant(node.get("op1"), assigned)
+    if kind in BINARY_OPS:
+        return _invariant(node.get("op1"), assigned) and _invariant(node.get("op2"), assigned)
+    return False
+
+
+def _read_names(node):
+    if node.elem_type == InterpreterBase.VAR_DEF:
+        return {node.get("name")}
+    names = set()
+    for key in ("op1", "op2", "expression"):
+        if node.get(key) is not None:
+            names |= _read_names(node.get(key))
+    return names
+
+
+class StrengthReductionPass(Pass):
+    name = "strength-reduction"
+    level = 2
+    requires = ("constant-folding",)
+
+    def run(self, program_ast):
+        stack = [program_ast]
+        while stack:
+            node = stack.pop()
+            if node.elem_type == InterpreterBase.WHILE_DEF:
+                self.__reduce_loop(node)
+            for value in node.dict.values():
+                items = value if isinstance(value, list) else [value]
+                stack.extend(item for item in items if isinstance(item, Element))
+        return program_ast
+
+    def __reduce_loop(self, while_ast):
+        for var, step in _induction_vars(while_ast).items():
+            self.__rewrite(while_ast, var, step)
+
+    def __rewrite(self, node, var, step):
+        for key, value in node.dict.items():
+            items = value if isinstance(value, list) else [value]
+            rewritten = []
+            for item in items:
+                if isinstance(item, Element) and item.elem_type != InterpreterBase.LAMBDA_DEF:
+                    self.__rewrite(item, var, step)
+                    item = _reduce(item, var, step)
+                rewritten.append(item)
+            node.dict[key] = rewritten if isinstance(value, list) else rewritten[0]
+
+
+# variables the loop body steps exactly once, unconditionally, by a constant,
+# and assigns nowhere else -> their steps
+def _induction_vars(while_ast):
+    steps = {}
+    for statement in while_ast.get("statements"):
+        if statement.elem_type == "=" and "." not in statement.get("name"):
+            step = induction_step(statement.get("name"), statement.get("expression"))
+            if step is not None:
+                steps.setdefault(statement.get("name"), []).append(step)
+    counts = {}
+    for node in loop_nodes(while_ast):
+        if node.elem_type == "=":
+            name = node.get("name")
+            counts[name] = counts.get(name, 0) + 1
+    return {
+        var: found[0]
+        for var, found in steps.items()
+        if len(found) == 1 and counts[var] == 1
+    }
+
+
+# an induction_mul node for var * k / k * var, otherwise the node itself
+def _reduce(node, var, step):
+    if node.elem_type != "*":
+        return node
+    left, right = node.get("op1"), node.get("op2")
+    if _is_plain_var(left) and left.get("name") == var:
+        factor = right
+    elif _is_plain_var(right) and right.get("name") == var:
+        factor = left
+    else:
+        return node
+    if factor.elem_type != InterpreterBase.INT_DEF:
+        return node
+    reduced = Element(
+        INDUCTION_MUL_DEF, expression=node, var=var, factor=factor.get("val"), step=step
+    )
+    reduced.last_index = None
+    reduced.last_product = None
+    return reduced
@@ -0,0 +1,357 @@
+from math import comb
+
+from analysis_v4 import children
+from intbase import InterpreterBase
+from passes_v4 import CSE_DEF, CSE_USE, INDUCTION_MUL_DEF, INVARIANT_DEF, Pass
+from type_valuev4 import Type, Value, concat, flat
+
+# Counted-loop recognition.
+#
+# Recognizes while loops of the shape
+#
+#   while (i < n) { s = s + <expr>; c = c + 1; t = t + "x"; i = i + 1; }
+#
+# i.e. an int induction variable stepped by a constant and compared against a
+# loop-invariant bound, with a body made only of reductions whose right-hand
+# sides are built from the induction variable, invariant variables and
+# literals.  Such a loop has no effect other than its final variable values,
+# so it can be run without interpreting the body: int reductions are
+# polynomials in the induction variable and are summed in closed form (or with
+# a native range loop for high degrees), and string reductions repeat an
+# invariant suffix.  CountedLoop.run() checks the runtime types first and
+# declines (returns False) whenever the regular interpreter could behave
+# differently, e.g. raise an error.
+
+CLOSED_FORM_MAX_DEGREE = 16
+
+# nodes later passes wrap loop expressions in; the plan looks through them
+WRAPPER_KINDS = (INVARIANT_DEF, INDUCTION_MUL_DEF, CSE_DEF, CSE_USE)
+
+# relation with the bound on the left -> same relation with the variable on the left
+FLIPPED = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+
+def _plain_var(node):
+    if node.elem_type == InterpreterBase.VAR_DEF and "." not in node.get("name"):
+        return node.get("name")
+    return None
+
+
+def _int_literal(node):
+    if node.elem_type == InterpreterBase.INT_DEF:
+        return node.get("val")
+    if node.elem_type == InterpreterBase.NEG_DEF:
+        value = _int_literal(node.get("op1"))
+        return None if value is None else -value
+    return None
+
+
+# names referenced by a reduction term, or None if the term is not built from
+# + - * neg, literals and plain variables
+def _term_names(node):
+    kind = node.elem_type
+    if kind in (InterpreterBase.INT_DEF, InterpreterBase.STRING_DEF):
+        return set()
+    if kind == InterpreterBase.VAR_DEF:
+        name = _plain_var(node)
+        return None if name is None else {name}
+    if kind == InterpreterBase.NEG_DEF:
+        return _term_names(node.get("op1"))
+    if kind in ("+", "-", "*"):
+        left = _term_names(node.get("op1"))
+        right = _term_names(node.get("op2"))
+        if left is None or right is None:
+            return None
+        return left | right
+    return None
+
+
+# splits `acc + a - b + c` into [(+1, a), (-1, b), (+1, c)] if acc is the
+# leftmost operand of a chain of + and -
+def _reduction_terms(acc, node):
+    terms = []
+    while node.elem_type in ("+", "-"):
+        terms.append((1 if node.elem_type == "+" else -1, node.get("op2")))
+        node = node.get("op1")
+    if _plain_var(node) != acc:
+        return None
+    terms.reverse()
+    return terms
+
+
+# the step k of `var = var + k`, `var = var - k` or `var = k + var` for a nonzero
+# int literal k, or None if expr does not step var that way
+def induction_step(var, expr):
+    if expr.elem_type not in ("+", "-"):
+        return None
+    left, right = expr.get("op1"), expr.get("op2")
+    if _plain_var(left) == var and _int_literal(right) is not None:
+        step = _int_literal(right)
+        step = step if expr.elem_type == "+" else -step
+    elif expr.elem_type == "+" and _plain_var(right) == var:
+        step = _int_literal(left)
+    else:
+        return None
+    return step or None
+
+
+class Reduction:
+    def __init__(self, acc, terms, prepend, after_step):
+        self.acc = acc
+        self.terms = terms  # [(sign, term_ast)] added to the accumulator
+        self.prepend = prepend  # acc = <term> + acc rather than acc = acc + <term>
+        self.after_step = after_step  # runs after the induction variable is stepped
+
+
+class CountedLoop:
+    def __init__(self, var, relation, bound, step, reductions, invariants):
+        self.var = var
+        self.relation = relation  # var <relation> bound
+        self.bound = bound  # int literal or invariant variable name
+        self.step = step
+        self.reductions = reductions
+        self.invariants = invariants
+
+    # returns a CountedLoop if the while loop has the recognized shape
+    @staticmethod
+    def match(while_ast):
+        cond = while_ast.get("condition")
+        if cond.elem_type not in FLIPPED:
+            return None
+        relation = cond.elem_type
+        var = _plain_var(cond.get("op1"))
+        bound_ast = cond.get("op2")
+        if var is None:
+            var = _plain_var(cond.get("op2"))
+            bound_ast = cond.get("op1")
+            relation = FLIPPED[relation]
+        if var is None:
+            return None
+        bound = _int_literal(bound_ast)
+        if bound is None:
+            bound = _plain_var(bound_ast)
+        if bound is None or bound == var:
+            return None
+
+        step = None
+        reductions = []
+        for statement in while_ast.get("statements"):
+            if statement.elem_type != "=" or "." in statement.get("name"):
+                return None
+            target = statement.get("name")
+            expr = statement.get("expression")
+            if target == var:
+                if step is not None:
+                    return None
+                step = induction_step(var, expr)
+                if step is None:
+                    return None
+                continue
+            reduction = CountedLoop.__match_reduction(target, expr, step is not None)
+            if reduction is None:
+                return None
+            reductions.append(reduction)
+
+        if step is None or (step > 0) != (relation in ("<", "<=")):
+            return None
+        written = {var} | {r.acc for r in reductions}
+        if len(written) != len(reductions) + 1 or bound in written:
+            return None
+        invariants = set()
+        for reduction in reductions:
+            for _, term in reduction.terms:
+                names = _term_names(term)
+                if names is None or (names & written) - {var}:
+                    return None
+                invariants |= names - {var}
+        if isinstance(bound, str):
+            invariants.add(bound)
+        return CountedLoop(var, relation, bound, step, reductions, invariants)
+
+    @staticmethod
+    def __match_reduction(acc, expr, after_step):
+        terms = _reduction_terms(acc, expr)
+        if terms:
+            return Reduction(acc, terms, False, after_step)
+        if expr.elem_type == "+" and _plain_var(expr.get("op2")) == acc:
+            return Reduction(acc, [(1, expr.get("op1"))], True, after_step)
+        return None
+
+    # runs the loop against the environment if the runtime types allow it;
+    # returns False (without touching anything) if the loop must be interpreted
+    def run(self, env):
+        var_value = env.get(self.var)
+        if var_value is None or var_value.t != Type.INT:
+            return False
+        cells = {self.var: var_value}
+        for name in self.invariants | {r.acc for r in self.reductions}:
+            value = env.get(name)
+            if value is None or value.t not in (Type.INT, Type.STRING):
+                return False
+            cells[name] = value
+        # aliased variables (ref parameters) would see each other's updates
+        if len({id(value) for value in cells.values()}) != len(cells):
+            return False
+        if isinstance(self.bound, str):
+            if cells[self.bound].t != Type.INT:
+                return False
+            bound = cells[self.bound].v
+        else:
+            bound = self.bound
+
+        start = var_value.v
+        trips = self.__trip_count(start, bound)
+        results = []
+        for reduction in self.reductions:
+            result = self.__reduce(reduction, cells, start, trips)
+            if result is None:
+                return False
+            results.append(result)
+
+        for reduction, result in zip(self.reductions, results):
+            cells[reduction.acc].set(result)
+        var_value.set(Value(Type.INT, start + trips * self.step))
+        return True
+
+    def __trip_count(self, start, bound):
+        step = self.step
+        if self.relation == "<":
+            return max(0, -((start - bound) // step))
+        if self.relation == "<=":
+            return (bound - start) // step + 1 if start <= bound else 0
+        if self.relation == ">":
+            return max(0, -((bound - start) // -step))
+        return (start - bound) // -step + 1 if start >= bound else 0
+
+    def __reduce(self, reduction, cells, start, trips):
+        acc = cells[reduction.acc]
+        if acc.t == Type.STRING:
+            suffix = ""
+            for sign, term in reduction.terms:
+                text = _string_term(term, cells)
+                if sign < 0 or text is None:
+                    return None
+                suffix += text
+            if reduction.prepend:
+                return Value(Type.STRING, concat(suffix * trips, acc.v))
+            return Value(Type.STRING, concat(acc.v, suffix * trips))
+
+        poly = [0]
+        for sign, term in reduction.terms:
+            term_poly = _int_poly(term, self.var, cells)
+            if term_poly is None:
+                return None
+            poly = _poly_add(poly, [sign * c for c in term_poly])
+        first = start + self.step if reduction.after_step else start
+        return Value(Type.INT, acc.v + _progression_sum(poly, first, self.step, trips))
+
+
+# gives every while node its CountedLoop plan (None if it has to be interpreted)
+class CountedLoopPass(Pass):
+    name = "counted-loops"
+    level = 1
+
+    def run(self, program_ast):
+        stack = [program_ast]
+        while stack:
+            node = stack.pop()
+            if node.elem_type == InterpreterBase.WHILE_DEF:
+                node.counted_loop = CountedLoop.match(node)
+            stack.extend(children(node))
+        return program_ast
+
+
+# the value of an invariant string term, or None if it is not a string
+def _string_term(node, cells):
+    kind = node.elem_type
+    if kind in WRAPPER_KINDS:
+        return _string_term(node.get("expression"), cells)
+    if kind == InterpreterBase.STRING_DEF:
+        return node.get("val")
+    if kind == InterpreterBase.VAR_DEF:
+        value = cells[node.get("name")]
+        return flat(value.v) if value.t == Type.STRING else None
+    if kind == "+":
+        left = _string_term(node.get("op1"), cells)
+        right = _string_term(node.get("op2"), cells)
+        if left is None or right is None:
+            return None
+        return left + right
+    return None
+
+
+# the term as a polynomial in var (coefficients, lowest degree first), or None
+# if it does not type check as an int expression
+def _int_poly(node, var, cells):
+    kind = node.elem_type
+    if kind in WRAPPER_KINDS:
+        return _int_poly(node.get("expression"), var, cells)
+    if kind == InterpreterBase.INT_DEF:
+        return [node.get("val")]
+    if kind == InterpreterBase.VAR_DEF:
+        name = node.get("name")
+        if name == var:
+            return [0, 1]
+        value = cells[name]
+        return [value.v] if value.t == Type.INT else None
+    if kind == InterpreterBase.NEG_DEF:
+        poly = _int_poly(node.get("op1"), var, cells)
+        return None if poly is None else [-c for c in poly]
+    if kind == InterpreterBase.STRING_DEF:
+        return None
+    left = _int_poly(node.get("op1"), var, cells)
+    right = _int_poly(node.get("op2"), var, cells)
+    if left is None or right is None:
+        return None
+    if kind == "+":
+        return _poly_add(left, right)
+    if kind == "-":
+        return _poly_add(left, [-c for c in right])
+    return _poly_mul(left, right)
+
+
+def _poly_add(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    return [c + (b[i] if i < len(b) else 0) for i, c in enumerate(a)]
+
+
+def _poly_mul(a, b):
+    result = [0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            result[i + j] += x * y
+    return result
+
+
+def _poly_eval(poly, x):
+    result = 0
+    for c in reversed(poly):
+        result = result * x + c
+    return result
+
+
+# sum of poly(first + t * step) for t in range(trips)
+def _progression_sum(poly, first, step, trips):
+    if trips == 0:
+        return 0
+    degree = len(poly) - 1
+    if degree <= CLOSED_FORM_MAX_DEGREE:
+        # substitute x = first + step * t, then sum each power of t
+        in_t = [0]
+        for c in reversed(poly):
+            in_t = _poly_add(_poly_mul(in_t, [first, step]), [c])
+        return sum(c * s for c, s in zip(in_t, _power_sums(trips, len(in_t) - 1)))
+
+    last = first + (trips - 1) * step
+    return sum(_poly_eval(poly, x) for x in range(first, last + step, step))
+
+
+# [sum(t ** j for t in range(n)) for j in range(degree + 1)], via
+# n ** (j + 1) == sum(comb(j + 1, k) * S_k for k in range(j + 1))
+def _power_sums(n, degree):
+    sums = []
+    for j in range(degree + 1):
+        total = n ** (j + 1) - sum(comb(j + 1, k) * sums[k] for k in range(j))
+        sums.append(total // (j + 1))
+    return sums
@@ -0,0 +1,178 @@
+from intbase import ErrorType
+from type_valuev4 import Type, Value, concat, flat
+
+# The operator dispatch matrix shared by the v4 execution engines.
+#
+# DISPATCH is one flat list indexed by dispatch_index(op_id, left type, right
+# type), where unary operators use NO_TYPE for the missing right operand.  Each
+# entry is the final word on what that operation does: its handler (raw)
+# applies any int<->bool coercion before computing the result, and entries for
+# invalid combinations carry the error to raise instead.  The table is built
+# once, when this module is imported.
+#
+# Handlers take and return unboxed values (see type_valuev4.unbox), which is
+# what the interpreter evaluates operators on; constant folding unboxes the
+# literals it folds and boxes the result.
+
+BINARY_OPS = ("+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">=", "&&", "||")
+UNARY_OPS = ("neg", "!")
+
+OP_IDS = {op: op_id for op_id, op in enumerate(BINARY_OPS + UNARY_OPS)}
+
+NO_TYPE = 0
+TYPE_SLOTS = max(t.value for t in Type) + 1
+
+
+# _value_ is the plain attribute behind Enum.value, which is a (slow) property
+def dispatch_index(op_id, left_type, right_type=None):
+    right = NO_TYPE if right_type is None else right_type._value_
+    return (op_id * TYPE_SLOTS + left_type._value_) * TYPE_SLOTS + right
+
+
+class OpEntry:
+    def __init__(self, raw, error=None, result_type=None):
+        self.raw = raw  # takes the unboxed operands, returns the result
+        self.error = error  # (ErrorType, description) raised instead, if not None
+        self.result_type = result_type  # Type of the handler's results
+
+
+# closures compare by the Closure a Value holds; an unboxed operand of another
+# type is its own payload
+def _payload(operand):
+    return operand.v if isinstance(operand, Value) else operand
+
+
+# operations each type supports once both operands have been promoted to it.
+# The functions take unboxed operands, where objects and closures stay Values,
+# as objects compare by Value identity
+TYPE_OPS = {
+    Type.INT: {
+        "+": lambda x, y: x + y,
+        "-": lambda x, y: x - y,
+        "*": lambda x, y: x * y,
+        "/": lambda x, y: x // y,
+        "==": lambda x, y: x == _payload(y),
+        "!=": lambda x, y: x != _payload(y),
+        "<": lambda x, y: x < y,
+        "<=": lambda x, y: x <= y,
+        ">": lambda x, y: x > y,
+        ">=": lambda x, y: x >= y,
+    },
+    Type.STRING: {
+        "+": concat,
+        "==": lambda x, y: flat(x) == flat(_payload(y)),
+        "!=": lambda x, y: flat(x) != flat(_payload(y)),
+    },
+    Type.BOOL: {
+        "&&": lambda x, y: x and y,
+        "||": lambda x, y: x or y,
+        "==": lambda x, y: x == _payload(y),
+        "!=": lambda x, y: x != _payload(y),
+    },
+    Type.NIL: {
+        "==": lambda x, y: x == _payload(y),
+        "!=": lambda x, y: x != _payload(y),
+    },
+    Type.CLOSURE: {
+        "==": lambda x, y: x.v == _payload(y),
+        "!=": lambda x, y: x.v != _payload(y),
+    },
+    Type.OBJECT: {
+        "==": lambda x, y: x is y,
+        "!=": lambda x, y: x is not y,
+    },
+}
+
+
+def int_to_bool(x):
+    return x != 0
+
+
+def bool_to_int(x):
+    return 1 if x else 0
+
+
+def int_to_bool_to_int(x):
+    return 1 if x != 0 else 0
+
+
+# works out the coercions applied to one operand: ints become bools for the
+# logical/equality operators (unless both sides are ints), and bools become
+# ints for the arithmetic/comparison operators
+def _promote(op, operand_type, both_ints):
+    steps = []
+    if op in TYPE_OPS[Type.BOOL] and not (op in TYPE_OPS[Type.INT] and both_ints):
+        if operand_type == Type.INT:
+            steps.append(Type.BOOL)
+            operand_type = Type.BOOL
+    if op in TYPE_OPS[Type.INT]:
+        if operand_type == Type.BOOL:
+            steps.append(Type.INT)
+            operand_type = Type.INT
+    if steps == [Type.BOOL]:
+        return operand_type, int_to_bool
+    if steps == [Type.INT]:
+        return operand_type, bool_to_int
+    if steps == [Type.BOOL, Type.INT]:
+        return operand_type, int_to_bool_to_int
+    return operand_type, None
+
+
+def _binary_entry(op, left_type, right_type):
+    both_ints = left_type == Type.INT and right_type == Type.INT
+    left_type, left_conv = _promote(op, left_type, both_ints)
+    right_type, right_conv = _promote(op, right_type, both_ints)
+
+    # DOCUMENT: allow comparisons ==/!= of anything against anything
+    if op not in ("==", "!=") and left_type != right_type:
+        return OpEntry(
+            None, (ErrorType.TYPE_ERROR, f"Incompatible types for {op} operation")
+        )
+    if op not in TYPE_OPS[left_type]:
+        return OpEntry(
+            None,
+            (ErrorType.TYPE_ERROR, f"Incompatible operator {op} for type {left_type}"),
+        )
+
+    f = TYPE_OPS[left_type][op]
+    result_type = left_type if op in ("+", "-", "*", "/") else Type.BOOL
+    if left_conv is None and right_conv is None:
+        return OpEntry(f, result_type=result_type)
+    left_conv = left_conv or (lambda x: x)
+    right_conv = right_conv or (lambda x: x)
+    return OpEntry(lambda x, y: f(left_conv(x), right_conv(y)), result_type=result_type)
+
+
+def _unary_entry(op, operand_type):
+    if op == "neg":
+        if operand_type != Type.INT:
+            return OpEntry(
+                None, (ErrorType.TYPE_ERROR, "Incompatible type for neg operation")
+            )
+        return OpEntry(lambda x: -1 * x, result_type=Type.INT)
+    if operand_type == Type.INT:
+        return OpEntry(lambda x: x == 0, result_type=Type.BOOL)
+    if operand_type != Type.BOOL:
+        return OpEntry(None, (ErrorType.TYPE_ERROR, "Incompatible type for ! operation"))
+    return OpEntry(lambda x: not x, result_type=Type.BOOL)
+
+
+def _build_dispatch():
+    table = [None] * (len(OP_IDS) * TYPE_SLOTS * TYPE_SLOTS)
+    for op in BINARY_OPS:
+        for left_type in Type:
+            for right_type in Type:
+                index = dispatch_index(OP_IDS[op], left_type, right_type)
+                table[index] = _binary_entry(op, left_type, right_type)
+    for op in UNARY_OPS:
+        for operand_type in Type:
+            table[dispatch_index(OP_IDS[op], operand_type)] = _unary_entry(op, operand_type)
+    return table
+
+
+DISPATCH = _build_dispatch()
+
+
+# the entry for an operator applied to operands of the given types
+def lookup(op, left_type, right_type=None):
+    return DISPATCH[dispatch_index(OP_IDS[op], left_type, right_type)]
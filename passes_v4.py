@@ -0,0 +1,206 @@
+import time
+
+from element import Element
+from intbase import InterpreterBase
+
+# AST optimization pass framework.
+#
+# A pass is a subclass of Pass that rewrites (or annotates) the functions of
+# the program AST returned by brewparse.parse_program.  Each pass declares the
+# optimization level it is enabled at and the passes that must run before it.
+# The PassManager picks the passes for a level, orders them by their
+# dependencies, checks that the tree is still well formed after each one and
+# records how long each pass took.
+#
+# Functions are compiled lazily, one at a time, the first time they are
+# called: a program run only pays for the functions it reaches.  The pass
+# manager keeps track of how far along the pipeline each function is (in its
+# `stage`), so that a pass that reads other functions' bodies can have them
+# brought up to its own stage first (see InlinePass).
+
+
+# node kinds that only passes create
+BLOCK_DEF = "block"  # statements run in a scope of their own, like an if branch
+INVARIANT_DEF = "invariant"  # expression evaluated once per entry to its loop
+INDUCTION_MUL_DEF = "induction_mul"  # var * factor, updated as var is stepped
+INLINED_DEF = "inlined"  # a call with the callee's body substituted in
+CSE_DEF = "cse_def"  # expression whose value later cse_use nodes reuse
+CSE_USE = "cse_use"  # the value of an earlier cse_def for the same expression
+
+
+class InvalidASTError(Exception):
+    pass
+
+
+class Pass:
+    name = None
+    level = 1  # lowest optimization level that enables this pass
+    requires = ()  # names of passes that must run before this one
+
+    # one instance of each pass compiles all the functions of a program
+    def __init__(self, options, manager):
+        self.options = options  # the interpreter's optimization options
+        self.manager = manager  # the PassManager, and through it the whole program
+
+    # rewrites the functions of program_ast (a program node holding the
+    # functions being compiled) in place, and returns program_ast
+    def run(self, program_ast):
+        return program_ast
+
+
+class PassManager:
+    def __init__(self, level, passes, options=None):
+        self.level = level
+        self.options = options or {}
+        self.program_ast = None
+        self.passes = []
+        self.timings = {}
+        self.total_time = 0.0  # sum of the timings
+        by_name = {p.name: p for p in passes}
+        enabled = [p for p in passes if p.level <= level]
+
+        # dependencies run first, even if their own level would not enable them
+        self.pipeline = []
+        visiting = set()
+
+        def add(pass_cls):
+            if pass_cls in self.pipeline:
+                return
+            if pass_cls.name in visiting:
+                raise ValueError(f"Pass dependency cycle through {pass_cls.name}")
+            visiting.add(pass_cls.name)
+            for name in pass_cls.requires:
+                if name not in by_name:
+                    raise ValueError(f"Pass {pass_cls.name} requires unknown pass {name}")
+                add(by_name[name])
+            visiting.discard(pass_cls.name)
+            self.pipeline.append(pass_cls)
+
+        for pass_cls in enabled:
+            add(pass_cls)
+
+    # starts on a new program; none of its functions is compiled yet
+    def load(self, program_ast):
+        self.program_ast = program_ast
+        self.passes = [pass_cls(self.options, self) for pass_cls in self.pipeline]
+        self.timings = {pass_cls.name: 0.0 for pass_cls in self.pipeline}
+        self.total_time = 0.0
+        for func_ast in program_ast.get("functions"):
+            func_ast.stage = 0  # number of pipeline passes run over the function
+
+    # runs the passes the function has not been through yet, up to the one
+    # named `until` (or to the end of the pipeline)
+    def compile(self, func_ast, until=None):
+        stop = len(self.passes)
+        if until is not None:
+            stop = [p.name for p in self.passes].index(until)
+        unit = Element(InterpreterBase.PROGRAM_DEF, functions=[func_ast])
+        while func_ast.stage < stop:
+            current = self.passes[func_ast.stage]
+            start = time.perf_counter()
+            nested_start = self.total_time
+            current.run(unit)
+            # time spent compiling other functions from within the pass counts
+            # toward the passes that ran on them
+            elapsed = time.perf_counter() - start - (self.total_time - nested_start)
+            self.timings[current.name] += elapsed
+            self.total_time += elapsed
+            func_ast.stage += 1
+            validate_ast(unit, current.name)
+
+
+# Fields each node kind must have, and what they hold:
+#   expr - an expression node, stmts - a list of statements, exprs - a list of
+#   expressions, formals - a list of arg/refarg nodes, funcs - a list of func
+#   nodes, str/int/bool - a Python value of that type; "?" marks optional fields
+EXPR = "expr"
+STMTS = "stmts"
+NODE_FIELDS = {
+    InterpreterBase.PROGRAM_DEF: {"functions": "funcs"},
+    InterpreterBase.FUNC_DEF: {"name": "str", "args": "formals", "statements": STMTS},
+    InterpreterBase.LAMBDA_DEF: {"args": "formals", "statements": STMTS},
+    InterpreterBase.ARG_DEF: {"name": "str"},
+    InterpreterBase.REFARG_DEF: {"name": "str"},
+    "=": {"name": "str", "expression": EXPR},
+    InterpreterBase.IF_DEF: {"condition": EXPR, "statements": STMTS, "else_statements": "stmts?"},
+    InterpreterBase.WHILE_DEF: {"condition": EXPR, "statements": STMTS},
+    InterpreterBase.RETURN_DEF: {"expression": "expr?"},
+    InterpreterBase.FCALL_DEF: {"name": "str", "args": "exprs"},
+    InterpreterBase.MCALL_DEF: {"objref": "str", "name": "str", "args": "exprs"},
+    InterpreterBase.VAR_DEF: {"name": "str"},
+    InterpreterBase.INT_DEF: {"val": "int"},
+    InterpreterBase.STRING_DEF: {"val": "str"},
+    InterpreterBase.BOOL_DEF: {"val": "bool"},
+    InterpreterBase.NIL_DEF: {},
+    InterpreterBase.OBJ_DEF: {},
+    InterpreterBase.NEG_DEF: {"op1": EXPR},
+    InterpreterBase.NOT_DEF: {"op1": EXPR},
+    BLOCK_DEF: {"statements": STMTS},
+    INVARIANT_DEF: {"expression": EXPR},
+    INDUCTION_MUL_DEF: {"expression": EXPR, "var": "str", "factor": "int", "step": "int"},
+    INLINED_DEF: {"name": "str", "args": "exprs", "formals": "formals", "statements": STMTS},
+    CSE_DEF: {"expression": EXPR},
+    CSE_USE: {"expression": EXPR},
+}
+for op in ("+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">=", "&&", "||"):
+    NODE_FIELDS[op] = {"op1": EXPR, "op2": EXPR}
+
+STATEMENT_KINDS = {
+    "=",
+    InterpreterBase.IF_DEF,
+    InterpreterBase.WHILE_DEF,
+    InterpreterBase.RETURN_DEF,
+    BLOCK_DEF,
+}
+NON_EXPRESSION_KINDS = STATEMENT_KINDS | {
+    InterpreterBase.PROGRAM_DEF,
+    InterpreterBase.FUNC_DEF,
+    InterpreterBase.ARG_DEF,
+    InterpreterBase.REFARG_DEF,
+}
+
+
+def _check_field(node, field, spec, where):
+    value = node.get(field)
+    if spec.endswith("?"):
+        if value is None:
+            return []
+        spec = spec[:-1]
+    problem = f"{where}: bad '{field}' field in {node.elem_type} node"
+    if spec in ("str", "int", "bool"):
+        expected = {"str": str, "int": int, "bool": bool}[spec]
+        if not isinstance(value, expected):
+            raise InvalidASTError(problem)
+        return []
+    if spec == EXPR:
+        if not isinstance(value, Element) or value.elem_type in NON_EXPRESSION_KINDS:
+            raise InvalidASTError(problem)
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(v, Element) for v in value):
+        raise InvalidASTError(problem)
+    allowed = {
+        "funcs": {InterpreterBase.FUNC_DEF},
+        "formals": {InterpreterBase.ARG_DEF, InterpreterBase.REFARG_DEF},
+    }.get(spec)
+    for item in value:
+        if allowed is not None and item.elem_type not in allowed:
+            raise InvalidASTError(problem)
+        if spec == "exprs" and item.elem_type in NON_EXPRESSION_KINDS:
+            raise InvalidASTError(problem)
+        if spec == STMTS and item.elem_type in NON_EXPRESSION_KINDS - STATEMENT_KINDS:
+            raise InvalidASTError(problem)
+    return value
+
+
+# raises InvalidASTError if the tree is not one the interpreter can run
+def validate_ast(program_ast, where="parser"):
+    if not isinstance(program_ast, Element) or program_ast.elem_type != InterpreterBase.PROGRAM_DEF:
+        raise InvalidASTError(f"{where}: the AST root is not a program node")
+    stack = [program_ast]
+    while stack:
+        node = stack.pop()
+        fields = NODE_FIELDS.get(node.elem_type)
+        if fields is None:
+            raise InvalidASTError(f"{where}: unknown node type {node.elem_type}")
+        for field, spec in fields.items():
+            stack.extend(_check_field(node, field, spec, where))
@@ -0,0 +1,57 @@
+from ops_v4 import DISPATCH, OP_IDS, dispatch_index
+
+# Type-feedback quickening for operator nodes.
+#
+# Every binary/unary operator node gets an OpSite that remembers the operand
+# types it has seen.  Once a site has run with a valid type combination, it
+# specializes to that combination's entry in the shared dispatch matrix and
+# skips the matrix lookup and error check while the operand types keep
+# matching.  Sites run the entries' handlers for unboxed operands (see
+# type_valuev4.unbox).  A site that keeps seeing new types gives up and stays generic.
+
+MAX_DEOPTS = 4
+
+
+class OpSite:
+    def __init__(self, op, unary=False):
+        self.op = op
+        self.op_id = OP_IDS[op]
+        self.unary = unary
+        self.left_type = None
+        self.right_type = None
+        self.handler = None  # set while the site is specialized
+        self.hits = 0  # executions that took the fast path
+        self.misses = 0  # executions that took the generic path
+        self.deopts = 0  # times a specialization was thrown away
+
+    # called when the site is about to take the generic path for these types
+    def record(self, left_type, right_type=None):
+        self.misses += 1
+        if self.handler is not None:
+            self.handler = None
+            self.deopts += 1
+        if self.deopts >= MAX_DEOPTS:
+            return
+        entry = DISPATCH[dispatch_index(self.op_id, left_type, right_type)]
+        if entry.error is None:
+            self.left_type = left_type
+            self.right_type = right_type
+            self.handler = entry.raw
+
+    def state(self):
+        if self.handler is not None:
+            return "specialized"
+        if self.deopts >= MAX_DEOPTS:
+            return "megamorphic"
+        return "generic"
+
+    def stats(self):
+        types = (self.left_type,) if self.unary else (self.left_type, self.right_type)
+        return {
+            "op": self.op,
+            "state": self.state(),
+            "types": tuple(t.name for t in types if t is not None),
+            "hits": self.hits,
+            "misses": self.misses,
+            "deopts": self.deopts,
+        }
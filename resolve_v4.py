@@ -0,0 +1,126 @@
+from analysis_v4 import base_name, children
+from intbase import InterpreterBase
+from passes_v4 import BLOCK_DEF, INLINED_DEF, Pass
+
+# Static resolution of variables to their frame.
+#
+# Brewin v4 scoping is dynamic: an assignment to a name that no scope holds yet
+# creates it in the innermost scope, and a function body sees every variable of
+# its callers.  Where a name is bound can thus only be decided statically for a
+# function's (or lambda's) parameters: they are put in the function's frame
+# when it is entered, and as a block scope can only create names that are not
+# bound anywhere yet, no scope the body pushes later can bind them again.  So in
+# the body, reads of a parameter and assignments to it are marked frame_local,
+# and the interpreter goes straight to the frame (at env depth frame_base)
+# instead of walking the scopes above it.  All other names are looked up by
+# name when they are used.
+#
+# Frames stay dicts, as callees look up their callers' variables by name.
+# Inlined bodies run without a frame of their own (see __run_inlined), so only
+# the lambdas in them are resolved; the pass runs after inlining and CSE, which
+# copy and rename variable nodes.
+
+
+class FrameResolutionPass(Pass):
+    name = "frame-resolution"
+    level = 1
+
+    def run(self, program_ast):
+        for func_ast in program_ast.get("functions"):
+            self.__resolve(func_ast)
+        return program_ast
+
+    # resolves a function or lambda body
+    def __resolve(self, func_ast):
+        params = {formal.get("name") for formal in func_ast.get("args")}
+        for statement in func_ast.get("statements"):
+            self.__visit(statement, params)
+
+    def __visit(self, node, params):
+        kind = node.elem_type
+        if kind == InterpreterBase.LAMBDA_DEF:
+            self.__resolve(node)
+            return
+        if kind in (InterpreterBase.VAR_DEF, "="):
+            node.frame_local = base_name(node.get("name")) in params
+        if kind == INLINED_DEF:
+            for arg in node.get("args"):
+                self.__visit(arg, params)
+            for statement in node.get("statements"):
+                self.__visit(statement, set())
+            return
+        for child in children(node):
+            self.__visit(child, params)
+
+
+# Scope elision.
+#
+# Every if branch, while body and block runs in a scope of its own, where the
+# assignments in it create the variables that are not bound anywhere yet.  A
+# block none of whose own assignments can create a variable does not need that
+# scope, so ScopeElisionPass marks which ones do (scoped, and else_scoped for
+# else branches) and the interpreter runs the others in the enclosing scope.
+# An assignment cannot create its variable if the name is definitely bound
+# when the block is entered: it is a parameter, or it was assigned earlier by
+# a statement of an enclosing block of the same body (the scope that statement
+# bound it in is still there).  Assignments in nested blocks, lambdas and
+# callees go to scopes of their own, and member assignments never create.
+class ScopeElisionPass(Pass):
+    name = "scope-elision"
+    level = 1
+
+    def run(self, program_ast):
+        for func_ast in program_ast.get("functions"):
+            self.__body(func_ast, set())
+        return program_ast
+
+    # function, lambda and inlined bodies; an inlined body runs in the middle
+    # of its caller, so what is bound there is bound in the body as well
+    def __body(self, func_ast, bound):
+        formals = func_ast.get("formals" if func_ast.elem_type == INLINED_DEF else "args")
+        bound = bound | {formal.get("name") for formal in formals}
+        self.__statements(func_ast.get("statements"), bound)
+
+    # bound: the names definitely bound before the statements, which is
+    # updated as they assign more
+    def __statements(self, statements, bound):
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == InterpreterBase.IF_DEF:
+                self.__expr(statement.get("condition"), bound)
+                statement.scoped = self.__block(statement.get("statements"), bound)
+                statement.else_scoped = self.__block(statement.get("else_statements") or [], bound)
+            elif kind == InterpreterBase.WHILE_DEF:
+                self.__expr(statement.get("condition"), bound)
+                statement.scoped = self.__block(statement.get("statements"), bound)
+            elif kind == BLOCK_DEF:
+                statement.scoped = self.__block(statement.get("statements"), bound)
+            else:
+                self.__expr(statement, bound)
+                if kind == "=" and "." not in statement.get("name"):
+                    bound.add(statement.get("name"))
+
+    # true if the block needs a scope of its own
+    def __block(self, statements, bound):
+        scoped = any(
+            statement.elem_type == "="
+            and "." not in statement.get("name")
+            and statement.get("name") not in bound
+            for statement in statements
+        )
+        self.__statements(statements, set(bound))
+        return scoped
+
+    # finds the lambda and inlined bodies in an expression or simple statement
+    def __expr(self, node, bound):
+        kind = node.elem_type
+        if kind == InterpreterBase.LAMBDA_DEF:
+            self.__body(node, set())
+            return
+        if kind == INLINED_DEF:
+            for arg in node.get("args"):
+                self.__expr(arg, bound)
+            self.__body(node, bound)
+            return
+        for child in children(node):
+            self.__expr(child, bound)
@@ -0,0 +1,88 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from env_v4 import POOL_SIZE, EnvironmentManager  # noqa: E402
+from interpreterv4 import Interpreter  # noqa: E402
+
+# Tests for scope pooling (env_v4.py), directly and through the counts that
+# Interpreter.get_allocation_stats() reports.
+
+DEPTH = 40
+RECURSION = f"""
+func down(n) {{ if (n == 0) {{ return 0; }} return 1 + down(n - 1); }}
+func main() {{
+  print(down({DEPTH}));
+  print(down({DEPTH}));
+}}
+"""
+CALLS = """
+func add(a, b) { return a + b; }
+func main() {
+  i = 0;
+  s = 0;
+  while (i < 100) { s = add(s, i); i = i + 1; }
+  print(s);
+}
+"""
+
+
+def allocation_stats(source, **config):
+    interpreter = Interpreter(console_output=False, **config)
+    interpreter.run(source)
+    return interpreter.get_allocation_stats()
+
+
+class ScopePoolTest(unittest.TestCase):
+    def test_popped_scopes_are_reused(self):
+        env = EnvironmentManager()
+        for _ in range(3):
+            env.push()
+            env.create("x", None)
+            env.pop()
+        self.assertEqual((env.scopes_allocated, env.scopes_reused), (1, 2))
+        scope = env.new_scope()
+        self.assertEqual(scope, {})
+        self.assertEqual(env.scopes_reused, 3)
+
+    def test_pool_is_bounded(self):
+        env = EnvironmentManager()
+        for _ in range(POOL_SIZE + 10):
+            env.push()
+        for _ in range(POOL_SIZE + 10):
+            env.pop()
+        self.assertEqual(len(env.pool), POOL_SIZE)
+        self.assertEqual(env.scopes_allocated, POOL_SIZE + 10)
+        for _ in range(POOL_SIZE + 10):
+            env.push()
+        self.assertEqual(env.scopes_reused, POOL_SIZE)
+        self.assertEqual(env.scopes_allocated, POOL_SIZE + 20)
+        self.assertEqual(env.pool, [])
+
+
+class AllocationStatsTest(unittest.TestCase):
+    def test_sequential_calls(self):
+        for level in range(Interpreter.MAX_OPT_LEVEL + 1):
+            with self.subTest(level=level):
+                stats = allocation_stats(CALLS, opt_level=level, inline_budget=0)
+                # the call's scope, and at -O0 the loop body's
+                self.assertLessEqual(stats["scopes allocated"], 3)
+                self.assertGreaterEqual(stats["scopes reused"], 99)
+
+    def test_recursion_reuses_the_first_descent(self):
+        for level in range(Interpreter.MAX_OPT_LEVEL + 1):
+            with self.subTest(level=level):
+                stats = allocation_stats(RECURSION, opt_level=level)
+                # each frame of the first descent is a new scope, and the
+                # second descent finds all of them in the pool
+                self.assertLessEqual(stats["scopes allocated"], DEPTH + 3)
+                self.assertGreaterEqual(stats["scopes reused"], DEPTH + 1)
+                total = stats["scopes allocated"] + stats["scopes reused"]
+                self.assertGreaterEqual(total, 2 * (DEPTH + 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
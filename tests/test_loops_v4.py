@@ -0,0 +1,97 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from brewparse import parse_program  # noqa: E402
+from env_v4 import EnvironmentManager  # noqa: E402
+from interpreterv4 import Interpreter  # noqa: E402
+from intbase import InterpreterBase  # noqa: E402
+from loops_v4 import CLOSED_FORM_MAX_DEGREE, CountedLoop, _poly_eval, _progression_sum  # noqa: E402
+from type_valuev4 import Type, Value  # noqa: E402
+
+# Tests for counted loops (loops_v4.py): the closed-form sums against summing
+# term by term, and whole loops run natively against the same loops run by the
+# interpreter at -O0, where the counted-loops pass is off.
+
+HIGH_DEGREE = CLOSED_FORM_MAX_DEGREE + 3
+
+
+def power(var, degree):
+    return " * ".join([var] * degree)
+
+
+# (variables set before the loop, the loop); every variable is printed after it
+LOOPS = [
+    ({"i": 0, "s": 0}, "while (i < 10) { s = s + i * i; i = i + 1; }"),
+    ({"i": 10, "s": 0}, "while (i > -7) { s = s + i * i - 3 * i; i = i - 3; }"),
+    ({"i": 20, "s": 0, "c": 0}, "while (i >= 1) { s = s + i; c = c + 1; i = i - 2; }"),
+    ({"i": -4, "s": 1, "n": 11}, "while (i <= n) { s = s + 2 - i * 7; i = i + 4; }"),
+    ({"i": -4, "s": 1}, "while (11 >= i) { s = s + 2 - i * 7; i = i + 4; }"),
+    ({"i": 0, "s": 0}, "while (i < 9) { i = i + 2; s = s + i * i * i; }"),
+    # zero-trip loops
+    ({"i": 5, "s": 3}, "while (i < 5) { s = s + i; i = i + 1; }"),
+    ({"i": 9, "s": 3}, "while (i <= 2) { s = s + i; i = i + 3; }"),
+    ({"i": 0, "s": 3}, "while (i > 0) { s = s + i; i = i - 1; }"),
+    ({"i": -1, "s": 3}, "while (i >= 0) { s = s + i * i; i = i - 5; }"),
+    # degrees around the closed-form limit, stepping both ways
+    ({"i": 0, "s": 0}, f"while (i < 25) {{ s = s + {power('i', CLOSED_FORM_MAX_DEGREE)}; i = i + 1; }}"),
+    ({"i": -12, "s": 0}, f"while (i < 13) {{ s = s + {power('i', HIGH_DEGREE)}; i = i + 2; }}"),
+    ({"i": 30, "s": 5}, f"while (i > -30) {{ s = s - {power('i', HIGH_DEGREE)} + i; i = i - 7; }}"),
+    ({"i": 3, "s": 0}, f"while (i > 3) {{ s = s + {power('i', HIGH_DEGREE)}; i = i - 1; }}"),
+]
+
+
+def find_while(node):
+    if node.elem_type == InterpreterBase.WHILE_DEF:
+        return node
+    for value in node.dict.values():
+        for child in value if isinstance(value, list) else [value]:
+            if hasattr(child, "elem_type"):
+                found = find_while(child)
+                if found is not None:
+                    return found
+    return None
+
+
+def interpreted(variables, loop):
+    assignments = " ".join(f"{name} = {value};" for name, value in variables.items())
+    printed = ', " ", '.join(variables)
+    source = f"func main() {{ {assignments} {loop} print({printed}); }}"
+    interpreter = Interpreter(console_output=False, opt_level=0)
+    interpreter.run(source)
+    return [int(value) for value in interpreter.get_output()[0].split(" ")]
+
+
+class ProgressionSumTest(unittest.TestCase):
+    def test_against_term_by_term(self):
+        polys = [[0], [5], [1, -2], [3, 0, -1], [1] * CLOSED_FORM_MAX_DEGREE]
+        polys += [[(-1) ** k * k for k in range(HIGH_DEGREE + 1)]]
+        for poly in polys:
+            for first in (-9, 0, 4):
+                for step in (-3, -1, 1, 2):
+                    for trips in (0, 1, 2, 17):
+                        expected = sum(_poly_eval(poly, first + t * step) for t in range(trips))
+                        with self.subTest(poly=poly, first=first, step=step, trips=trips):
+                            self.assertEqual(_progression_sum(poly, first, step, trips), expected)
+
+
+class CountedLoopTest(unittest.TestCase):
+    def test_native_runs_match_interpreter(self):
+        for variables, loop in LOOPS:
+            with self.subTest(loop=loop):
+                loop_ast = find_while(parse_program(f"func main() {{ {loop} }}"))
+                plan = CountedLoop.match(loop_ast)
+                self.assertIsNotNone(plan)
+                env = EnvironmentManager()
+                for name, value in variables.items():
+                    env.create(name, Value(Type.INT, value))
+                self.assertTrue(plan.run(env))
+                native = [env.get(name).v for name in variables]
+                self.assertEqual(native, interpreted(variables, loop))
+
+
+if __name__ == "__main__":
+    unittest.main()
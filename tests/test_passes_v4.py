@@ -0,0 +1,154 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from brewparse import parse_program  # noqa: E402
+from element import Element  # noqa: E402
+from intbase import InterpreterBase  # noqa: E402
+from interpreterv4 import Interpreter  # noqa: E402
+from passes_v4 import InvalidASTError, Pass, PassManager, validate_ast  # noqa: E402
+
+# Tests for the AST pass manager (passes_v4.py) and the -O levels the
+# interpreter builds on it.
+
+PROGRAM = """
+func add(a, b) { return a + b; }
+func unused() { return 1 + 2; }
+func main() {
+  x = 2 * 3;
+  print(add(x, 1));
+}
+"""
+
+
+def make_pass(name, level=1, requires=()):
+    return type(name, (Pass,), {"name": name, "level": level, "requires": requires})
+
+
+# a pass that replaces every return value by a statement, which is no expression
+class BreakReturnsPass(Pass):
+    name = "break-returns"
+
+    def run(self, program_ast):
+        for func_ast in program_ast.get("functions"):
+            for statement in func_ast.get("statements"):
+                if statement.elem_type == InterpreterBase.RETURN_DEF:
+                    statement.dict["expression"] = Element(
+                        InterpreterBase.WHILE_DEF, condition=None, statements=[]
+                    )
+        return program_ast
+
+
+def names(pipeline):
+    return [pass_cls.name for pass_cls in pipeline]
+
+
+class PassManagerTest(unittest.TestCase):
+    def test_dependencies_run_first(self):
+        fold = make_pass("fold")
+        inline = make_pass("inline", level=2, requires=("fold",))
+        resolve = make_pass("resolve", level=2, requires=("inline", "fold"))
+        manager = PassManager(2, [resolve, inline, fold])
+        self.assertEqual(names(manager.pipeline), ["fold", "inline", "resolve"])
+
+    def test_dependencies_run_below_their_level(self):
+        late = make_pass("late", level=2)
+        early = make_pass("early", level=1, requires=("late",))
+        self.assertEqual(names(PassManager(1, [early, late]).pipeline), ["late", "early"])
+        self.assertEqual(PassManager(0, [early, late]).pipeline, [])
+
+    def test_dependency_cycle(self):
+        first = make_pass("first", requires=("second",))
+        second = make_pass("second", requires=("first",))
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            PassManager(1, [first, second])
+
+    def test_unknown_dependency(self):
+        needy = make_pass("needy", requires=("missing",))
+        with self.assertRaisesRegex(ValueError, "unknown pass missing"):
+            PassManager(1, [needy])
+
+    def test_interpreter_pipelines(self):
+        for level in range(Interpreter.MAX_OPT_LEVEL + 1):
+            pipeline = PassManager(level, Interpreter.PASSES).pipeline
+            for i, pass_cls in enumerate(pipeline):
+                for name in pass_cls.requires:
+                    self.assertIn(name, names(pipeline[:i]))
+
+    def test_invalid_pass_output(self):
+        manager = PassManager(1, [BreakReturnsPass])
+        program_ast = parse_program(PROGRAM)
+        manager.load(program_ast)
+        func_ast = program_ast.get("functions")[0]
+        with self.assertRaisesRegex(InvalidASTError, "break-returns"):
+            manager.compile(func_ast)
+
+
+class ValidateAstTest(unittest.TestCase):
+    def test_parsed_program(self):
+        validate_ast(parse_program(PROGRAM))
+
+    def test_root_must_be_program(self):
+        with self.assertRaises(InvalidASTError):
+            validate_ast(Element(InterpreterBase.INT_DEF, val=1))
+
+    def test_unknown_node(self):
+        program_ast = parse_program(PROGRAM)
+        main_ast = program_ast.get("functions")[2]
+        main_ast.get("statements").append(Element("mystery"))
+        with self.assertRaisesRegex(InvalidASTError, "unknown node type mystery"):
+            validate_ast(program_ast)
+
+    def test_bad_field(self):
+        program_ast = parse_program(PROGRAM)
+        assign_ast = program_ast.get("functions")[2].get("statements")[0]
+        assign_ast.dict["name"] = 5
+        with self.assertRaisesRegex(InvalidASTError, "bad 'name' field"):
+            validate_ast(program_ast, "test")
+
+    def test_statement_as_expression(self):
+        program_ast = parse_program(PROGRAM)
+        assign_ast = program_ast.get("functions")[2].get("statements")[0]
+        assign_ast.dict["expression"] = Element(InterpreterBase.RETURN_DEF, expression=None)
+        with self.assertRaises(InvalidASTError):
+            validate_ast(program_ast)
+
+
+class OptLevelTest(unittest.TestCase):
+    def test_invalid_levels(self):
+        for level in (-1, Interpreter.MAX_OPT_LEVEL + 1, "2"):
+            with self.subTest(level=level):
+                with self.assertRaises(ValueError):
+                    Interpreter(console_output=False, opt_level=level)
+
+    def test_pass_timings(self):
+        for level in range(Interpreter.MAX_OPT_LEVEL + 1):
+            with self.subTest(level=level):
+                interpreter = Interpreter(console_output=False, opt_level=level)
+                interpreter.run(PROGRAM)
+                self.assertEqual(interpreter.get_output(), ["7"])
+                timings = interpreter.get_pass_timings()
+                pipeline = PassManager(level, Interpreter.PASSES).pipeline
+                self.assertEqual([name for name, _ in timings], names(pipeline))
+                self.assertTrue(all(seconds >= 0 for _, seconds in timings))
+
+
+class LazyCompileTest(unittest.TestCase):
+    def test_uncalled_functions_stay_uncompiled(self):
+        for level in range(Interpreter.MAX_OPT_LEVEL + 1):
+            with self.subTest(level=level):
+                interpreter = Interpreter(console_output=False, opt_level=level)
+                interpreter.run(PROGRAM)
+                table = interpreter.func_name_to_ast
+                self.assertFalse(table["unused"][0].compiled)
+                self.assertEqual(table["unused"][0].stage, 0)
+                self.assertTrue(table["main"][0].compiled)
+                # at -O2, add is inlined into main and never called itself
+                self.assertEqual(table["add"][2].compiled, level < 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
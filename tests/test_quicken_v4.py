@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from intbase import ErrorType  # noqa: E402
+from interpreterv4 import Interpreter  # noqa: E402
+from quicken_v4 import MAX_DEOPTS  # noqa: E402
+
+# Tests for the type feedback of operator sites (quicken_v4.py), as reported by
+# Interpreter.get_op_site_stats().  Each program has a single operator, in a
+# function that main calls with the given operands; at -O0 no pass folds,
+# inlines or types it, so every call runs through the site.
+
+OPERANDS = {"int": ("1", "2"), "string": ('"a"', '"b"'), "bool": ("true", "false")}
+
+
+def program(calls, body="return a + b;"):
+    lines = [f"func op(a, b) {{ {body} }}", "func main() {"]
+    for kind in calls:
+        left, right = OPERANDS[kind]
+        lines.append(f"  print(op({left}, {right}));")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def site_stats(source):
+    interpreter = Interpreter(console_output=False, opt_level=0)
+    try:
+        interpreter.run(source)
+    except Exception:
+        error_type, _ = interpreter.get_error_type_and_line()
+        if error_type is None:
+            raise
+    (stats,) = interpreter.get_op_site_stats()
+    return stats
+
+
+class OpSiteTest(unittest.TestCase):
+    def test_specializes_on_first_run(self):
+        stats = site_stats(program(["int"] * 3))
+        self.assertEqual(stats["state"], "specialized")
+        self.assertEqual(stats["types"], ("INT", "INT"))
+        self.assertEqual((stats["hits"], stats["misses"], stats["deopts"]), (2, 1, 0))
+
+    def test_respecializes_on_new_types(self):
+        stats = site_stats(program(["int", "int", "string", "string", "string"]))
+        self.assertEqual(stats["state"], "specialized")
+        self.assertEqual(stats["types"], ("STRING", "STRING"))
+        self.assertEqual((stats["hits"], stats["misses"], stats["deopts"]), (3, 2, 1))
+
+    def test_gives_up_after_max_deopts(self):
+        calls = ["int", "string"] * MAX_DEOPTS + ["int", "int", "int"]
+        stats = site_stats(program(calls))
+        self.assertEqual(stats["state"], "megamorphic")
+        self.assertEqual(stats["deopts"], MAX_DEOPTS)
+        self.assertEqual(stats["hits"], 0)
+        self.assertEqual(stats["misses"], len(calls))
+
+    def test_not_specialized_on_type_errors(self):
+        source = program(["int"], body='return a + "x";')
+        stats = site_stats(source)
+        self.assertEqual(stats["state"], "generic")
+        self.assertEqual((stats["hits"], stats["misses"]), (0, 1))
+        interpreter = Interpreter(console_output=False, opt_level=0)
+        with self.assertRaises(Exception):
+            interpreter.run(source)
+        self.assertEqual(interpreter.get_error_type_and_line()[0], ErrorType.TYPE_ERROR)
+
+    def test_unary_site(self):
+        stats = site_stats(program(["bool", "bool", "int"], body="return !a;"))
+        self.assertEqual(stats["op"], "!")
+        self.assertEqual(stats["state"], "specialized")
+        self.assertEqual(stats["types"], ("INT",))
+        self.assertEqual((stats["hits"], stats["misses"], stats["deopts"]), (1, 2, 1))
+
+    def test_no_sites_without_quickening(self):
+        interpreter = Interpreter(console_output=False, opt_level=0, quicken=False)
+        interpreter.run(program(["int"] * 3))
+        self.assertEqual(interpreter.get_op_site_stats(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
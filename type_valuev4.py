@@ -1,4 +1,5 @@
 import copy
+import weakref
 
 from enum import Enum
 from intbase import InterpreterBase
@@ -13,35 +14,203 @@ class Type(Enum):
     NIL = 5
     OBJECT = 6
 
+# Copy-on-write objects.
+#
+# Passing or returning an object by value copies it deeply.  copy_value() makes
+# such a copy lazily instead: the new Object starts out empty, remembering the
+# object it is a copy of, and is only filled in (with a deep copy of the
+# source, as of when copy_value() was called) when it is first used.  That is
+# sound for as long as nothing that the source can reach has changed, so every
+# lazy copy that is still pending is made before the first write that could
+# change an object graph: a member assignment, a closure changing type (see
+# __assign), or a write to a Value that an object or closure holds (one marked
+# `heap`; Value.set is the only way to change a Value).  Writes to plain
+# variables, which are most of them, leave pending copies alone.
+_pending = weakref.WeakSet()  # lazy copies not made yet
+
+
+# makes every pending copy, before something is written
+def write_barrier():
+    if _pending:
+        for obj in list(_pending):
+            obj.materialize()
+
+
+# Memory layout.
+#
+# Programs allocate a Value for every variable, argument and member, so the
+# runtime classes use __slots__ rather than a __dict__ per instance.  An
+# Object keeps its members in a list of Values, apart from proto, which has a
+# slot; bench_v4.py's memory benchmark compares the sizes.
+#
+# Shapes (hidden classes).  Which member is at which index of that list is kept
+# by the object's Shape, which objects share: every object starts out with
+# EMPTY_SHAPE, and adding a member moves it to the shape that follows from its
+# current one by that member.  The shapes form a tree of such transitions, so
+# objects that got the same members in the same order have the same Shape.
+# Shapes never change once made.
+#
+# Objects found on a proto chain by a member lookup move to a prototype shape,
+# with the same offsets, from which transitions lead to prototype shapes as
+# well.  Adding a member to an object with a prototype shape, or changing any
+# object's proto (by assigning it, or by setting the Value it is held in),
+# bumps Object.chain_version, which the member inline caches (see icache_v4.py)
+# check before using a member they found on a proto chain.
+class Shape:
+    __slots__ = ("offsets", "transitions", "prototype", "prototype_shape")
+
+    def __init__(self, offsets, prototype=False):
+        self.offsets = offsets  # member name -> index, in the order added
+        self.transitions = {}  # member name -> Shape with it added
+        self.prototype = prototype
+        self.prototype_shape = None  # made on first use
+
+    def with_member(self, member):
+        shape = self.transitions.get(member)
+        if shape is None:
+            offsets = dict(self.offsets)
+            offsets[member] = len(offsets)
+            shape = Shape(offsets, self.prototype)
+            self.transitions[member] = shape
+        return shape
+
+    def as_prototype(self):
+        if self.prototype:
+            return self
+        if self.prototype_shape is None:
+            self.prototype_shape = Shape(self.offsets, True)
+        return self.prototype_shape
+
+
+EMPTY_SHAPE = Shape({})
+
+
 class Object:
+    __slots__ = ("proto", "shape", "values", "__copy_of", "__weakref__")
+    chain_version = 0
+
     def __init__(self):
         self.proto = Value(Type.NIL, None)
-        self.type = Type.OBJECT
-    
+        self.proto.heap = True
+        self.shape = EMPTY_SHAPE
+        self.values = []  # member Values, at the offsets of the shape
+        self.__copy_of = None  # (source Object, source Value, copy's Value) while pending
+
+    # a lazy copy of the object `value` holds, for the Value `copied`
+    @staticmethod
+    def lazy_copy(value, copied):
+        source = value.v
+        if source.__copy_of is not None:
+            # a copy of an unchanged copy is a copy of its source
+            source, value, _ = source.__copy_of
+        obj = Object.__new__(Object)
+        obj.shape = None  # while pending
+        obj.__copy_of = (source, value, copied)
+        _pending.add(obj)
+        return obj
+
+    def materialize(self):
+        if self.__copy_of is None:
+            return
+        source, value, copied = self.__copy_of
+        memo = {id(source): self, id(value): copied}
+        self.proto = copy.deepcopy(source.proto, memo)
+        self.shape = source.shape
+        self.values = copy.deepcopy(source.values, memo)
+        self.__copy_of = None
+        _pending.discard(self)
+
+    def __deepcopy__(self, memo):
+        self.materialize()
+        obj = Object.__new__(Object)
+        memo[id(self)] = obj
+        obj.proto = copy.deepcopy(self.proto, memo)
+        obj.shape = self.shape
+        obj.values = copy.deepcopy(self.values, memo)
+        obj.__copy_of = None
+        return obj
+
     def get_member(self, member):
-        if hasattr(self, member):
-            return getattr(self, member)
+        self.materialize()
+        if member == "proto":
+            return self.proto
+        holder, offset = self.find_member(member)
+        if holder is None:
+            return Value(Type.NIL, None)
+        return holder.values[offset]
+
+    # (object holding the member, its offset there), or (None, None); the
+    # objects on the proto chain that were searched become prototypes
+    def find_member(self, member):
+        obj = self
+        while True:
+            offset = obj.shape.offsets.get(member)
+            if offset is not None:
+                return obj, offset
+            if obj.proto.t != Type.OBJECT:
+                return None, None
+            obj = obj.proto.v
+            obj.materialize()
+            obj.shape = obj.shape.as_prototype()
+
+    def set_member(self, member, value):
+        if member == "proto":
+            self.proto = value
+            Object.chain_version += 1
+            return
+        offset = self.shape.offsets.get(member)
+        if offset is None:
+            if self.shape.prototype:
+                Object.chain_version += 1
+            self.shape = self.shape.with_member(member)
+            self.values.append(value)
         else:
-            temp = self.proto
-            while temp.type() != Type.NIL:
-                if hasattr(temp.value(), member):
-                    return getattr(temp.value(), member)
-                temp = temp.value().proto
-        return Value(Type.NIL, None)
+            self.values[offset] = value
+
+    # (member name, Value) pairs, in the order the members were added
+    def members(self):
+        return zip(self.shape.offsets, self.values)
 
 
 class Closure:
-    def __init__(self, func_ast, env):
-        self.captured_env = copy.deepcopy(env)
+    __slots__ = ("captured_env", "func_ast", "type")
+
+    # names: the variables of env the closure keeps a copy of
+    def __init__(self, func_ast, env, names=()):
+        self.captured_env = env.capture(names)
         self.func_ast = func_ast
         self.type = Type.CLOSURE     
 
+    # copies share the (immutable) function AST, along with the per-site state
+    # the interpreter keeps on its nodes
+    def __deepcopy__(self, memo):
+        closure = Closure.__new__(Closure)
+        memo[id(self)] = closure
+        closure.captured_env = copy.deepcopy(self.captured_env, memo)
+        closure.func_ast = self.func_ast
+        closure.type = self.type
+        return closure
+
 
 # Represents a value, which has a type and its value
 class Value:
+    __slots__ = ("t", "v", "heap")
+
     def __init__(self, t, v=None):
         self.t = t
         self.v = v
+        self.heap = False  # held by an object or a closure (see write_barrier)
+
+    # a new cell, which nothing holds yet
+    def __copy__(self):
+        return Value(self.t, self.v)
+
+    def __deepcopy__(self, memo):
+        value = Value(self.t)
+        value.heap = self.heap
+        memo[id(self)] = value
+        value.v = copy.deepcopy(self.v, memo)
+        return value
 
     def value(self):
         return self.v
@@ -50,9 +219,103 @@ class Value:
         return self.t
 
     def set(self, other):
+        if self.heap:
+            write_barrier()
+            if self.t is Type.OBJECT or other.t is Type.OBJECT:
+                Object.chain_version += 1  # may be an object's proto
         self.t = other.t
         self.v = other.v
 
+# same as copy.deepcopy(value), without going through deepcopy for the
+# primitive types, and with objects copied on first use (see Object)
+def copy_value(value):
+    if value.t in (Type.INT, Type.STRING, Type.BOOL, Type.NIL):
+        return Value(value.t, value.v)
+    if value.t == Type.OBJECT:
+        copied = Value(Type.OBJECT)
+        copied.v = Object.lazy_copy(value, copied)
+        return copied
+    return copy.deepcopy(value)
+
+
+# Ropes.
+#
+# Building a string with `s = s + "x"` in a loop copies s every time.  Once a
+# concatenation's result reaches ROPE_MIN_LENGTH, it is a Rope instead: the
+# list of the strings it is made of, which further concatenations append to.
+# Ropes never change, so the list is shared: a Rope is the first `count`
+# strings of it, and appending to a Rope that does not end the list (as one
+# made from it already did) copies its part of the list first.  A Rope is
+# joined into a str, once, when it is compared or printed (see flat()).
+ROPE_MIN_LENGTH = 64
+
+
+class Rope:
+    __slots__ = ("parts", "count")
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.count = len(parts)
+
+    def append(self, piece):
+        parts = self.parts
+        if len(parts) != self.count:
+            parts = parts[: self.count]
+        parts.append(piece)
+        return Rope(parts)
+
+    def __str__(self):
+        if self.count != 1:
+            self.parts = ["".join(self.parts[: self.count])]
+            self.count = 1
+        return self.parts[0]
+
+
+# the str an unboxed string is, or anything else as it is
+def flat(raw):
+    return str(raw) if type(raw) is Rope else raw
+
+
+# + on two unboxed strings
+def concat(left, right):
+    right = flat(right)
+    if type(left) is Rope:
+        return left.append(right)
+    if len(left) + len(right) < ROPE_MIN_LENGTH:
+        return left + right
+    return Rope([left, right])
+
+
+# Unboxed values.
+#
+# Variables are Values, which are mutable cells that can be shared (by ref
+# parameters and aliased objects), and objects and closures are compared by
+# their Values.  The result of an operator is never shared, though, so the
+# interpreter evaluates operators and conditions on unboxed values instead:
+# Python ints, strs (or Ropes) and bools, None for nil, and for objects and
+# closures the Value itself.  box() and unbox() convert between the two.
+RAW_TYPES = {
+    int: Type.INT,
+    str: Type.STRING,
+    Rope: Type.STRING,
+    bool: Type.BOOL,
+    type(None): Type.NIL,
+}
+
+
+def unbox(value):
+    if value.t is Type.OBJECT or value.t is Type.CLOSURE:
+        return value
+    return value.v
+
+
+# a new Value holding a primitive, or the Value of an object or closure
+def box(raw):
+    if isinstance(raw, Value):
+        return raw
+    return Value(RAW_TYPES[type(raw)], raw)
+
+
 def create_value(val):
     if val == InterpreterBase.TRUE_DEF:
         return Value(Type.BOOL, True)
@@ -67,14 +330,20 @@ def create_value(val):
 
 
 def get_printable(val):
+    val = box(val)
     if val.type() == Type.INT:
         return str(val.value())
     if val.type() == Type.STRING:
-        return val.value()
+        return flat(val.value())
     if val.type() == Type.BOOL:
         if val.value() is True:
             return "true"
         return "false"
     if val.type() == Type.OBJECT:
-        return str({k: v for k, v in vars(val.value()).items() if not callable(v)})
+        obj = val.value()
+        obj.materialize()
+        # the layout objects had before their members got a dict of their own
+        fields = {"proto": obj.proto, "type": Type.OBJECT}
+        fields.update(obj.members())
+        return str(fields)
     return None
\ No newline at end of file